@@ -4,7 +4,7 @@
 # pip3 install pyyaml -t .
 # sudo python3 -m pip install pyyaml
 
-from obo_parser import OBO_Parser, TermState
+from obo_parser import TermState, load_obo
 
 import requests
 import json
@@ -14,6 +14,7 @@ from dateutil.parser import parse
 
 from gzip import GzipFile
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import botocore
@@ -23,6 +24,9 @@ go_s3_bucket_name = "geneontology-public"
 go_obo_key = "go.obo"
 go_obo_url = "http://purl.obolibrary.org/obo/go.obo"
 
+# binary snapshots of the parsed ontologies; /tmp is the only writable directory of a lambda and is kept between warm invocations
+snapshot_rep = "/tmp/"
+
 #go_doi_url = "https://zenodo.org/api/records/1205166"
 go_pipeline_release_url = "http://current.geneontology.org/metadata/release-date.json"
 
@@ -53,7 +57,8 @@ def get_last_obo():
         key = obj.key
         if "go.obo" not in key:
             continue
-        date = obj.get()['LastModified'].replace(tzinfo=None)
+        # the listing already gives the modification date, no need to get each object
+        date = obj.last_modified.replace(tzinfo=None)
         if date > last_date:
             last_date = date
             last_obo = key
@@ -104,20 +109,28 @@ def flattern(A):
         else: rt.append(i)
     return rt
 
+def load_ontology(obo_url, snapshot_path):
+    return load_obo(requests.get(obo_url).content, snapshot_path)
+
 def save_changes():
 
     # The new published OBO archive
-    print("Loading current GO ontology...")
     go_obo_url = "http://purl.obolibrary.org/obo/go.obo"
-    newgo = OBO_Parser(requests.get(go_obo_url).text)
 
 # TO OVERRIDE COMPARISON
 #    last_date = "2019-02-01"
 #    last_obo = "archive/" + last_date + "_go.obo"
     # The last published OBO archive
-    print("Loading last GO ontology (" , last_obo , ") ...")
     old_go_obo_url = "https://s3.amazonaws.com/" + go_s3_bucket_name + "/" + last_obo
-    oldgo = OBO_Parser(requests.get(old_go_obo_url).text)
+
+    # Both are downloaded concurrently, one being parsed while the other is still downloading
+    # (threads: a lambda has no shared memory for multiprocessing)
+    print("Loading current GO ontology and last GO ontology (" , last_obo , ") ...")
+    with ThreadPoolExecutor(max_workers = 2) as executor:
+        newgo_future = executor.submit(load_ontology, go_obo_url, snapshot_rep + go_obo_key + ".snapshot")
+        oldgo_future = executor.submit(load_ontology, old_go_obo_url, snapshot_rep + last_obo.replace("/", "_") + ".snapshot")
+        newgo = newgo_future.result()
+        oldgo = oldgo_future.result()
     
     
     # New GO Terms
@@ -1,5 +1,11 @@
 import networkx as nx
 import re
+import io
+import os
+import gc
+import pickle
+import hashlib
+import sys
 
 from enum import Enum
 class TermState:
@@ -8,9 +14,24 @@ class TermState:
     OBSOLETE = 3
 
 def value(var):
+    if isinstance(var, tuple):
+        return list(var)
     return var if var is not None else "N/A"
 
+def append(values, value):
+    """
+    Return the tuple values (None if empty) extended with value
+    """
+    if values is None:
+        return (value, )
+    return values + (value, )
+
 class Term:
+    """
+    Term of an OBO file; its ids are interned and its multi valued fields are tuples (None when empty)
+    """
+
+    __slots__ = ("id", "alt_ids", "is_obsolete", "is_a", "namespace", "name", "comment", "synonyms", "definition", "created_by", "creation_date", "subsets", "xrefs")
     
     def __init__(self):
         self.id = None
@@ -28,29 +49,19 @@ class Term:
         self.xrefs = None
         
     def add_is_a(self, is_a):
-        if self.is_a is None:
-            self.is_a = []
-        self.is_a.append(is_a)
+        self.is_a = append(self.is_a, sys.intern(is_a))
         
     def add_alternate_id(self, alt_id):
-        if self.alt_ids is None:
-            self.alt_ids = []
-        self.alt_ids.append(alt_id)
+        self.alt_ids = append(self.alt_ids, sys.intern(alt_id))
         
     def add_synonym(self, synonym):
-        if self.synonyms is None:
-            self.synonyms = []
-        self.synonyms.append(synonym)
+        self.synonyms = append(self.synonyms, synonym)
         
     def add_subset(self, subset):
-        if self.subsets is None:
-            self.subsets = []
-        self.subsets.append(subset)
+        self.subsets = append(self.subsets, sys.intern(subset))
         
     def add_xref(self, xref):
-        if self.xrefs is None:
-            self.xrefs = []
-        self.xrefs.append(xref)
+        self.xrefs = append(self.xrefs, xref)
 
     def equals(self, other):
         return self.id == other.id and self.is_obsolete == other.is_obsolete and self.alt_ids == other.alt_ids and self.name == other.name and self.is_a == other.is_a and self.namespace == other.namespace and self.definition == other.definition and self.comment == other.comment and self.synonyms == other.synonyms and self.subsets == other.subsets and self.xrefs == other.xrefs
@@ -96,6 +107,54 @@ class Relation:
     def __str__(self):
         return self.id + "\t" + self.name
 
+def iter_lines(content):
+    """
+    Iterate over the lines (without line ending) of an OBO document given as a string, bytes, a file object or an iterator of lines (str or bytes)
+    """
+    if isinstance(content, str):
+        content = io.StringIO(content)
+    elif isinstance(content, bytes):
+        content = io.BytesIO(content)
+    for line in content:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        yield line.rstrip("\r\n")
+
+
+def header_item(line):
+    kv = re.split(":(?=\s)", line)
+    return kv[0].strip(), kv[1].strip()
+
+
+def read_header(content):
+    """
+    Return the header { tag: value } of an OBO document, reading only the lines before its first stanza
+    """
+    header = { }
+    for line in iter_lines(content):
+        if line.startswith("["):
+            break
+        if len(line) > 0:
+            key, value = header_item(line)
+            header[key] = value
+    return header
+
+
+def file_hash(path):
+    """
+    Return the sha256 (hex) of a file, read by chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# version of the binary snapshots (see OBO_Parser.save_snapshot); to increase whenever the parsed classes change
+SNAPSHOT_VERSION = 1
+
+
 # TODO: I have to add the is_a: term_id ! term_name but I have to add it in the edges of the graph
 # TODO: I can also add the consider (who link to other term_ids)
 # TODO: Other relations: intersection_of, relationship
@@ -106,93 +165,139 @@ class OBO_Parser:
     header = None
     obo_graph = None
     relation_graph = None
+    content_hash = None     # sha256 of the parsed document if known (see load_obo)
     
     def __init__(self, content):
-        self.content = content
+        """
+        Parse an OBO document given as a string, bytes, a file object or an iterator of lines
+        The document is read line by line, in one pass: only the current stanza is kept in memory
+        """
         self.obo_graph = nx.Graph()
         self.relation_graph = nx.Graph()
         self.header = { }
-        self._parseHeader()
-        self._parseTerms()
-        self._parseRelations()
+        self._parse(content)
+        print(self.header)
         print("oboparser: ", len(self.obo_graph) , " terms")
-            
-            
-    def _parseHeader(self):
-        lines = self.content.split(self.term_key)[0].split("\n")
-        for line in lines:
+
+
+    def _parse(self, content):
+        stanza = None
+        entity = None
+        for line in iter_lines(content):
             if len(line) == 0:
                 continue
-            kv = re.split(":(?=\s)", line)
-#            print("line: " , line , " kv: ", kv)
-            self.header[kv[0].strip()] = kv[1].strip()
-        print(self.header)
+
+            if line.startswith("["):
+                self._addEntity(entity)
+                stanza = line.strip()
+                if stanza == self.term_key:
+                    entity = Term()
+                elif stanza == self.type_def_key:
+                    entity = Relation()
+                else:
+                    entity = None
+                continue
+
+            if stanza is None:
+                self._parseHeaderLine(line)
+            elif stanza == self.term_key:
+                self._parseTermLine(entity, line)
+            elif stanza == self.type_def_key:
+                self._parseRelationLine(entity, line)
+        self._addEntity(entity)
+
+
+    def _addEntity(self, entity):
+        if isinstance(entity, Term):
+            self.obo_graph.add_node(entity.id, object=entity)
+        elif isinstance(entity, Relation):
+            self.relation_graph.add_node(entity.id, object=entity)
+
+
+    def _parseHeaderLine(self, line):
+        key, value = header_item(line)
+        self.header[key] = value
+
+
+    def _parseTermLine(self, term, line):
+        value = re.split(":(?=\s)", line)[1].strip()
+        if line.startswith("id"):
+            term.id = sys.intern(value)
+        elif line.startswith("alt_id"):
+            term.add_alternate_id(value)
+        elif line.startswith("namespace"):
+            term.namespace = sys.intern(value)
+        elif line.startswith("name"):
+            term.name = value
+        elif line.startswith("comment"):
+            term.comment = value
+        elif line.startswith("def"):
+            term.definition = value
+        elif line.startswith("synonym"):
+            term.add_synonym(value)
+        elif line.startswith("subset"):
+            term.add_subset(value)
+        elif line.startswith("is_obsolete"):
+            term.is_obsolete = value
+        elif line.startswith("xref"):
+            term.add_xref(value)
+        elif line.startswith("is_a"):
+            term.add_is_a(value.split(" ! ")[0].strip())
+
+
+    def _parseRelationLine(self, relation, line):
+        value = line.split(":")[1].strip()
+        if line.startswith("id"):
+            relation.id = value
+        elif line.startswith("name"):
+            relation.name = value
+        elif line.startswith("namespace"):
+            relation.namespace = value
+        elif line.startswith("xref"):
+            relation.xref = value
+        elif line.startswith("is_transitive"):
+            relation.is_transitive = value
+
+
+    def save_snapshot(self, path):
+        """
+        Save the parsed ontology as a binary snapshot, keyed on its data-version and content hash (see load_snapshot)
+        """
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "wb") as outfile:
+            pickle.dump((SNAPSHOT_VERSION, self.header.get("data-version"), self.content_hash), outfile, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self, outfile, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+
+    @staticmethod
+    def load_snapshot(path, content_hash = None, data_version = None):
+        """
+        Load a binary snapshot saved by save_snapshot
+        Return None if there is no snapshot, or if it was saved by another snapshot version, or for another content hash / data-version (if given)
+        """
+        try:
+            with open(path, "rb") as infile:
+                version, snapshot_data_version, snapshot_hash = pickle.load(infile)
+                if version != SNAPSHOT_VERSION:
+                    return None
+                if content_hash is not None and content_hash != snapshot_hash:
+                    return None
+                if data_version is not None and data_version != snapshot_data_version:
+                    return None
+
+                # the collector would otherwise repeatedly scan the many objects being created
+                gc_enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    return pickle.load(infile)
+                finally:
+                    if gc_enabled:
+                        gc.enable()
+        except (OSError, EOFError, ValueError, TypeError, AttributeError, pickle.UnpicklingError):
+            return None
 
 
-    def _parseTerms(self):
-        terms = self.content.split(self.term_key)
-        for i in range(1, len(terms)):
-            term = Term()
-
-            for line in terms[i].split("\n"):
-                if len(line) == 0:
-                    continue
-                
-                if line.startswith(self.type_def_key):
-                    break
-                
-                value = re.split(":(?=\s)", line)[1].strip()
-                if line.startswith("id"):
-                    term.id = value
-                elif line.startswith("alt_id"):
-                    term.add_alternate_id(value)
-                elif line.startswith("namespace"):
-                    term.namespace = value
-                elif line.startswith("name"):
-                    term.name = value
-                elif line.startswith("comment"):
-                    term.comment = value
-                elif line.startswith("def"):
-                    term.definition = value
-                elif line.startswith("synonym"):
-                    term.add_synonym(value)
-                elif line.startswith("subset"):
-                    term.add_subset(value)
-                elif line.startswith("is_obsolete"):
-                    term.is_obsolete = value
-                elif line.startswith("xref"):
-                    term.add_xref(value)
-                elif line.startswith("is_a"):
-                    term.add_is_a(value.split(" ! ")[0].strip())
-
-            self.obo_graph.add_node(term.id, object=term)
-            
-
-    def _parseRelations(self):
-        relations = self.content.split(self.type_def_key)
-
-        for i in range(1, len(relations)):
-            relation = Relation()
-
-            for line in relations[i].split("\n"):
-                if len(line) == 0:
-                    continue
-                
-                value = line.split(":")[1].strip()
-                if line.startswith("id"):
-                    relation.id = value
-                elif line.startswith("name"):
-                    relation.name = value
-                elif line.startswith("namespace"):
-                    relation.namespace = value
-                elif line.startswith("xref"):
-                    relation.xref = value
-                elif line.startswith("is_transitive"):
-                    relation.is_transitive = value
-
-            self.relation_graph.add_node(relation.id, object=relation)
-            
-            
     def get_nodes(self):
         return self.obo_graph.nodes(data=True)
 
@@ -212,4 +317,40 @@ class OBO_Parser:
     def get_term(self, query):
         if not self.has_term(query):
             return None
-        return self.obo_graph.nodes[query]['object']
\ No newline at end of file
+        return self.obo_graph.nodes[query]['object']
+
+
+def load_obo(source, snapshot_path = None):
+    """
+    Parse an OBO document given as a file path or as bytes, reusing the binary snapshot of a previous parse of the same document (same data-version and sha256)
+    The snapshot of a file is saved next to it (<path>.snapshot) unless snapshot_path is given; the snapshot of bytes is only saved if snapshot_path is given
+    """
+    if isinstance(source, bytes):
+        content_hash = hashlib.sha256(source).hexdigest()
+        data_version = read_header(source).get("data-version")
+    else:
+        content_hash = file_hash(source)
+        with open(source, "rb") as infile:
+            data_version = read_header(infile).get("data-version")
+        if snapshot_path is None:
+            snapshot_path = source + ".snapshot"
+
+    if snapshot_path:
+        obo = OBO_Parser.load_snapshot(snapshot_path, content_hash, data_version)
+        if obo is not None:
+            print("oboparser: ", len(obo.obo_graph) , " terms loaded from snapshot " + snapshot_path)
+            return obo
+
+    if isinstance(source, bytes):
+        obo = OBO_Parser(source)
+    else:
+        with open(source, "rb") as infile:
+            obo = OBO_Parser(infile)
+    obo.content_hash = content_hash
+
+    if snapshot_path:
+        try:
+            obo.save_snapshot(snapshot_path)
+        except OSError as e:
+            print("oboparser: could not save snapshot " + snapshot_path + ": " + str(e))
+    return obo
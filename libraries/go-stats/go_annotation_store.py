@@ -0,0 +1,393 @@
+# Compact columnar store of GO annotations
+# * each field is dictionary encoded: its values are interned in a Vocabulary and the annotations only keep the integer codes, in array columns
+# * multi-valued fields (eg reference, qualifier) are kept as a column of codes and a column of offsets (row i uses codes[offsets[i]:offsets[i + 1]])
+# * a store can be saved to a file and loaded back with mmap: the columns are then read-only views on the file, paged in on demand
+# * if numpy is available, the group by counts are vectorized over the columns (numpy views, without copy), otherwise computed in pure python
+
+import sys, os, json, mmap
+from array import array
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# default fields of a store (see AnnotationStore)
+FIELDS = ["bioentity", "annotation_class", "evidence_type", "taxon", "assigned_by", "aspect", "type"]
+LIST_FIELDS = ["reference", "qualifier"]
+
+# typecodes of the columns: codes are 32 bits, offsets of the multi-valued fields 64 bits
+CODE_TYPE = "i"
+OFFSET_TYPE = "q"
+
+STORE_MAGIC = b"GOSTORE1"
+STORE_VERSION = 1
+
+
+class Vocabulary:
+    """
+    Bidirectional map value <-> integer code, codes being attributed in the order the values are first seen
+    """
+
+    def __init__(self, values = None):
+        self.values = []
+        self.codes = { }
+        if values:
+            for value in values:
+                self.code(value)
+
+
+    def code(self, value):
+        """
+        Return the code of a value, adding it to the vocabulary if new
+        """
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+
+    def get_code(self, value):
+        """
+        Return the code of a value or None if not in the vocabulary
+        """
+        return self.codes.get(value)
+
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+class AnnotationStore:
+    """
+    Columnar store of GO annotations (maps using the GOLr annotation fields, eg go_gaf_stats.parse_gaf_line or GOLr docs)
+    * fields are the single-valued fields kept, list_fields the multi-valued ones; a missing field is stored as ""
+    * a store loaded from a file (see load) is read-only
+    """
+
+    def __init__(self, fields = None, list_fields = None):
+        self.fields = list(fields) if fields is not None else list(FIELDS)
+        self.list_fields = list(list_fields) if list_fields is not None else list(LIST_FIELDS)
+        self.vocabularies = { field : Vocabulary() for field in self.fields + self.list_fields }
+        self.columns = { field : array(CODE_TYPE) for field in self.fields + self.list_fields }
+        self.offsets = { field : array(OFFSET_TYPE, [0]) for field in self.list_fields }
+        self.size = 0
+        self.mmap = None
+
+
+    def add(self, annotation):
+        for field in self.fields:
+            value = annotation.get(field, "")
+            self.columns[field].append(self.vocabularies[field].code(value))
+        for field in self.list_fields:
+            vocabulary = self.vocabularies[field]
+            column = self.columns[field]
+            for value in annotation.get(field, []):
+                column.append(vocabulary.code(value))
+            self.offsets[field].append(len(column))
+        self.size += 1
+
+
+    def add_all(self, annotations):
+        for annotation in annotations:
+            if annotation is not None:
+                self.add(annotation)
+        return self
+
+
+    def __len__(self):
+        return self.size
+
+
+    def codes(self, field):
+        """
+        Return the column of codes of a single-valued field (or of all the values of a multi-valued field)
+        """
+        return self.columns[field]
+
+
+    def value(self, field, row):
+        return self.vocabularies[field][self.columns[field][row]]
+
+
+    def list_value(self, field, row):
+        offsets = self.offsets[field]
+        vocabulary = self.vocabularies[field]
+        return [vocabulary[code] for code in self.columns[field][offsets[row]:offsets[row + 1]]]
+
+
+    def annotation(self, row):
+        """
+        Return the annotation of a row as a map { field: value or [values] }
+        """
+        annotation = { }
+        for field in self.fields:
+            annotation[field] = self.value(field, row)
+        for field in self.list_fields:
+            annotation[field] = self.list_value(field, row)
+        return annotation
+
+
+    def iter_annotations(self, rows = None):
+        for row in (range(self.size) if rows is None else rows):
+            yield self.annotation(row)
+
+
+    def numpy_column(self, field, kind = "codes"):
+        """
+        Return the column of codes (or offsets) of a field as a numpy array, without copy (the store should not grow while the array is used)
+        """
+        column = self.columns[field] if kind == "codes" else self.offsets[field]
+        if len(column) == 0:
+            return numpy.zeros(0, dtype = column_typecode(kind))
+        return numpy.frombuffer(column, dtype = column_typecode(kind))
+
+
+    def select(self, rows = None, **conditions):
+        """
+        Return the rows (ascending) matching all the conditions field = value or field = [values], eg select(taxon = "NCBITaxon:9606", type = "protein")
+        rows restricts the selection to some rows; the result is a numpy array if numpy is available, otherwise an array
+        """
+        for field, values in conditions.items():
+            if isinstance(values, str):
+                values = [values]
+            vocabulary = self.vocabularies[field]
+            codes = set(vocabulary.get_code(value) for value in values) - { None }
+            if numpy is not None:
+                candidates = numpy.arange(self.size) if rows is None else numpy.asarray(rows, dtype = numpy.int64)
+                rows = candidates[numpy.isin(self.numpy_column(field)[candidates], list(codes))]
+            else:
+                column = self.columns[field]
+                candidates = range(self.size) if rows is None else rows
+                rows = array(CODE_TYPE, [row for row in candidates if column[row] in codes])
+        if rows is None:
+            return numpy.arange(self.size) if numpy is not None else array(CODE_TYPE, range(self.size))
+        return rows
+
+
+    def count_by(self, fields, rows = None):
+        """
+        Count the annotations (or only the given rows) by a field or a list of fields; at most one of them can be multi-valued (each of its values is then counted)
+        return { value: count } or { (value1, value2, ...): count }
+        """
+        single = isinstance(fields, str)
+        if single:
+            fields = [fields]
+        if len([field for field in fields if field in self.list_fields]) > 1:
+            raise ValueError("count_by supports only one multi-valued field")
+
+        if numpy is not None:
+            counts = self._count_codes_vectorized(fields, rows)
+        else:
+            counts = self._count_codes(fields, rows)
+
+        labels = [self.vocabularies[field].values for field in fields]
+        if single:
+            return { labels[0][key[0]] : count for key, count in counts }
+        return { tuple(field_labels[code] for field_labels, code in zip(labels, key)) : count for key, count in counts }
+
+
+    def first_rows(self, field, rows = None):
+        """
+        Return { value: first row (or first of the given rows) having that value } of a single-valued field
+        """
+        vocabulary = self.vocabularies[field]
+        if numpy is not None:
+            entries = numpy.arange(self.size) if rows is None else numpy.asarray(rows, dtype = numpy.int64)
+            codes, indexes = numpy.unique(self.numpy_column(field)[entries], return_index = True)
+            return { vocabulary[code] : row for code, row in zip(codes.tolist(), entries[indexes].tolist()) }
+        column = self.columns[field]
+        first = { }
+        for row in (range(self.size) if rows is None else rows):
+            if column[row] not in first:
+                first[column[row]] = row
+        return { vocabulary[code] : row for code, row in first.items() }
+
+
+    def _count_codes(self, fields, rows):
+        """
+        Pure python group by: return [(codes tuple, count)]
+        """
+        columns = [self.columns[field] for field in fields]
+        list_index = None
+        for index, field in enumerate(fields):
+            if field in self.list_fields:
+                list_index = index
+
+        if list_index is None:
+            if rows is not None:
+                columns = [[column[row] for row in rows] for column in columns]
+            counts = Counter(zip(*columns))
+        else:
+            offsets = self.offsets[fields[list_index]]
+            counts = Counter()
+            for row in (range(self.size) if rows is None else rows):
+                key = [column[row] if index != list_index else None for index, column in enumerate(columns)]
+                for position in range(offsets[row], offsets[row + 1]):
+                    key[list_index] = columns[list_index][position]
+                    counts[tuple(key)] += 1
+        return list(counts.items())
+
+
+    def _count_codes_vectorized(self, fields, rows):
+        """
+        numpy group by: the codes of the fields are combined into a single key (mixed radix) counted with bincount
+        return [(codes tuple, count)]
+        """
+        list_field = None
+        for field in fields:
+            if field in self.list_fields:
+                list_field = field
+
+        # entries: the row of each counted entry, positions: the position of its value in the multi-valued column
+        if list_field is None:
+            entries = numpy.arange(self.size) if rows is None else numpy.asarray(rows, dtype = numpy.int64)
+            positions = None
+        else:
+            offsets = self.numpy_column(list_field, "offsets")
+            entries = numpy.repeat(numpy.arange(self.size), numpy.diff(offsets))
+            positions = numpy.arange(len(entries))
+            if rows is not None:
+                selected = numpy.zeros(self.size, dtype = bool)
+                selected[numpy.asarray(rows, dtype = numpy.int64)] = True
+                keep = selected[entries]
+                entries = entries[keep]
+                positions = positions[keep]
+
+        keys = numpy.zeros(len(entries), dtype = numpy.int64)
+        sizes = []
+        for field in fields:
+            codes = self.numpy_column(field)[positions] if field == list_field else self.numpy_column(field)[entries]
+            size = len(self.vocabularies[field])
+            keys = keys * size + codes
+            sizes.append(size)
+
+        if len(keys) == 0:
+            return []
+        total = 1
+        for size in sizes:
+            total *= size
+        if total <= 4 * len(keys) + 1024:
+            counts = numpy.bincount(keys, minlength = total)
+            values = numpy.nonzero(counts)[0]
+            counts = counts[values]
+        else:
+            values, counts = numpy.unique(keys, return_counts = True)
+
+        codes = numpy.unravel_index(values, sizes)
+        return list(zip(zip(*[column.tolist() for column in codes]), counts.tolist()))
+
+
+    def group_by(self, field, rows = None):
+        """
+        Return { value: rows (array) } of a single-valued field, the values being in the order of their first row
+        """
+        column = self.columns[field]
+        groups = { }
+        for row in (range(self.size) if rows is None else rows):
+            code = column[row]
+            group = groups.get(code)
+            if group is None:
+                group = groups[code] = array(CODE_TYPE)
+            group.append(row)
+        vocabulary = self.vocabularies[field]
+        return { vocabulary[code] : group for code, group in groups.items() }
+
+
+    def save(self, path):
+        """
+        Save the store in a file that can be memory-mapped (see load)
+        layout: magic, header length (8 bytes), json header (fields, vocabularies, columns position), then the columns aligned on 8 bytes
+        """
+        blocks = []
+        for field in self.fields + self.list_fields:
+            blocks.append((field, "codes", self.columns[field]))
+        for field in self.list_fields:
+            blocks.append((field, "offsets", self.offsets[field]))
+
+        position = 0
+        columns = []
+        for field, kind, column in blocks:
+            itemsize = array(column_typecode(kind)).itemsize
+            columns.append({ "field" : field, "kind" : kind, "typecode" : column_typecode(kind), "itemsize" : itemsize, "offset" : position, "length" : len(column) })
+            position += align(len(column) * itemsize)
+
+        header = {
+            "version" : STORE_VERSION,
+            "byteorder" : sys.byteorder,
+            "size" : self.size,
+            "fields" : self.fields,
+            "list_fields" : self.list_fields,
+            "vocabularies" : { field : vocabulary.values for field, vocabulary in self.vocabularies.items() },
+            "columns" : columns
+        }
+        header = json.dumps(header).encode("utf-8")
+        header += b" " * (align(len(header)) - len(header))
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as outfile:
+            outfile.write(STORE_MAGIC)
+            outfile.write(len(header).to_bytes(8, "little"))
+            outfile.write(header)
+            for field, kind, column in blocks:
+                data = column.tobytes() if isinstance(column, array) else bytes(column)
+                outfile.write(data)
+                outfile.write(b"\0" * (align(len(data)) - len(data)))
+        os.replace(temp_path, path)
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a store saved with save: the columns are memory-mapped (read-only), only the vocabularies are read in memory
+        """
+        with open(path, "rb") as infile:
+            if infile.read(len(STORE_MAGIC)) != STORE_MAGIC:
+                raise ValueError(path + " is not an annotation store")
+            header_length = int.from_bytes(infile.read(8), "little")
+            header = json.loads(infile.read(header_length).decode("utf-8"))
+            data_start = len(STORE_MAGIC) + 8 + header_length
+            if header["version"] != STORE_VERSION:
+                raise ValueError(path + ": unsupported annotation store version " + str(header["version"]))
+            store_map = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+
+        store = cls(header["fields"], header["list_fields"])
+        store.size = header["size"]
+        store.mmap = store_map
+        for field, values in header["vocabularies"].items():
+            store.vocabularies[field] = Vocabulary(values)
+
+        view = memoryview(store_map)
+        for meta in header["columns"]:
+            if array(meta["typecode"]).itemsize != meta["itemsize"]:
+                raise ValueError(path + ": unsupported item size for typecode " + meta["typecode"])
+            start = data_start + meta["offset"]
+            data = view[start:start + meta["length"] * meta["itemsize"]]
+            if header["byteorder"] == sys.byteorder:
+                column = data.cast(meta["typecode"])
+            else:
+                # not directly usable on this platform: the column is copied in memory
+                column = array(meta["typecode"])
+                column.frombytes(data)
+                if header["byteorder"] != sys.byteorder:
+                    column.byteswap()
+            if meta["kind"] == "codes":
+                store.columns[meta["field"]] = column
+            else:
+                store.offsets[meta["field"]] = column
+        return store
+
+
+def column_typecode(kind):
+    return CODE_TYPE if kind == "codes" else OFFSET_TYPE
+
+def align(length, alignment = 8):
+    return (length + alignment - 1) // alignment * alignment
@@ -0,0 +1,119 @@
+# Persistent on-disk cache of GOLr responses (see go_stats_utils.enable_cache)
+
+import os, time, gzip, hashlib, threading
+
+
+class GolrCache:
+    """
+    Content addressed cache of GOLr responses, keyed on (golr base url, select query)
+    * each response is stored gzipped in <cache_rep>/<namespace>/<2 first chars of key>/<key>.json.gz
+    * in live mode (no release), responses older than ttl seconds are discarded
+    * in release-pinned mode, responses are stored under the release namespace and never expire (a released GOLr does not change)
+    * when the cache grows over max_size bytes, the least recently used responses are evicted
+    """
+
+    def __init__(self, cache_rep, ttl = 86400, max_size = 2 * 1024 * 1024 * 1024, release = None):
+        self.cache_rep = cache_rep
+        self.ttl = ttl
+        self.max_size = max_size
+        self.release = release
+        self.namespace = "release-" + release if release else "live"
+        self.size = None
+        self.lock = threading.RLock()
+
+
+    def path(self, golr_base_url, select_query):
+        key = hashlib.sha256((golr_base_url + "\n" + select_query).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_rep, self.namespace, key[:2], key + ".json.gz")
+
+
+    def get(self, golr_base_url, select_query):
+        """
+        Return the cached content (bytes) of a query or None if not cached / expired
+        """
+        path = self.path(golr_base_url, select_query)
+        try:
+            stat = os.stat(path)
+            if self.release is None and self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                self._remove(path, stat.st_size)
+                return None
+            with gzip.open(path, "rb") as infile:
+                content = infile.read()
+            # access time is used to find the least recently used responses, modification time for the ttl
+            os.utime(path, (time.time(), stat.st_mtime))
+            return content
+        except (OSError, EOFError):
+            return None
+
+
+    def put(self, golr_base_url, select_query, content):
+        """
+        Store the content (bytes) of a query; the file is written atomically so that concurrent readers never see a partial response
+        """
+        path = self.path(golr_base_url, select_query)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        temp_path = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+        with gzip.open(temp_path, "wb", 6) as outfile:
+            outfile.write(content)
+
+        with self.lock:
+            # the query may already be cached (eg fetched by two threads at once): only the size difference is added
+            try:
+                previous_size = os.path.getsize(path)
+            except OSError:
+                previous_size = 0
+            os.replace(temp_path, path)
+            if self.size is None:
+                self.size = self._compute_size()
+            else:
+                self.size += os.path.getsize(path) - previous_size
+            if self.max_size is not None and self.size > self.max_size:
+                self._evict()
+
+
+    def clear(self):
+        for path, stat in self._list_files():
+            self._remove(path, stat.st_size)
+
+
+    def _list_files(self):
+        files = []
+        for root, dirs, names in os.walk(self.cache_rep):
+            for name in names:
+                if not name.endswith(".json.gz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    files.append((path, os.stat(path)))
+                except OSError:
+                    continue
+        return files
+
+
+    def _compute_size(self):
+        return sum(stat.st_size for path, stat in self._list_files())
+
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            if self.size is not None:
+                self.size -= size
+
+
+    def _evict(self):
+        """
+        Remove the least recently used responses until the cache is back to 90% of its max size
+        """
+        files = self._list_files()
+        files.sort(key = lambda item: item[1].st_atime)
+        self.size = sum(stat.st_size for path, stat in files)
+        target = 0.9 * self.max_size
+        for path, stat in files:
+            if self.size <= target:
+                break
+            self._remove(path, stat.st_size)
+        print("GOLr cache evicted least recently used responses, size is now ", self.size, " bytes")
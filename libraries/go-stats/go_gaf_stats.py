@@ -0,0 +1,704 @@
+# Compute the GO stats (same structure as go_stats.compute_stats) from the GO annotation files and the GO ontology (OBO)
+# instead of a GOLr instance, eg from the files of a release:
+# * GAF 2.x files, or GPAD 1.1 files together with the GPI 1.2 files (type and taxon of the bioentities) and the ECO mapping (evidence codes)
+# * the annotation files are read line by line (local paths or URLs, plain, gzip or bz2, decompressed on the fly) and only the counts needed for the stats are kept in memory
+
+import sys, getopt, os, multiprocessing
+
+import go_stats_utils as utils
+import go_stats
+from obo_parser import TermState
+from go_annotation_store import AnnotationStore
+
+
+PROTEIN_BINDING = "GO:0005515"
+
+# annotation fields faceted by the GOLr queries of go_stats (golr_select_annotations and golr_select_qualifiers)
+ANNOTATION_FACETS = ["taxon", "aspect", "evidence_type", "assigned_by", "reference", "type", "qualifier"]
+
+# position of each aspect in the [all, P, F, C] counts (equivalent to the isa_partof_closure filters of the GOLr queries)
+ASPECT_INDEX = { "P" : 1, "F" : 2, "C" : 3 }
+ASPECT_MASK = { "P" : 1, "F" : 2, "C" : 4 }
+
+NAMESPACE_ASPECTS = {
+    "biological_process" : "P",
+    "molecular_function" : "F",
+    "cellular_component" : "C"
+}
+
+reference_genomes_ids = set(utils.REFERENCE_GENOME_IDS)
+
+
+def open_file(path):
+    """
+    Open an annotation / ontology file (local path or URL, plain, gzip or bz2) as a text file decompressed on the fly (see go_stats_utils.open_text)
+    """
+    return utils.open_text(path)
+
+def taxon_curie(taxon):
+    """
+    taxon:9606 -> NCBITaxon:9606 (taxon ids used by GOLr)
+    """
+    if taxon.startswith("taxon:"):
+        return "NCBITaxon:" + taxon[len("taxon:"):]
+    return taxon
+
+def split_values(value):
+    """
+    Split a multi-valued GAF / GPAD column (values separated by |), removing the duplicates
+    """
+    if value == "":
+        return []
+    return list(dict.fromkeys(value.split("|")))
+
+
+
+def parse_gaf_line(line):
+    """
+    Return the annotation of a GAF 2.x line as a map using the GOLr annotation fields, or None for a header / invalid line
+    """
+    if line.startswith("!"):
+        return None
+    cols = line.rstrip("\n").split("\t")
+    if len(cols) < 15:
+        return None
+    return {
+        "bioentity" : cols[0] + ":" + cols[1],
+        "qualifier" : [qualifier.lower() for qualifier in split_values(cols[3])],
+        "annotation_class" : cols[4],
+        "reference" : split_values(cols[5]),
+        "evidence_type" : cols[6],
+        "aspect" : cols[8],
+        "type" : cols[11],
+        "taxon" : taxon_curie(cols[12].split("|")[0]),
+        "assigned_by" : cols[14]
+    }
+
+def parse_gpad_line(line, bioentities, eco_map, aspects):
+    """
+    Return the annotation of a GPAD 1.1 line as a map using the GOLr annotation fields, or None for a header / invalid / unknown bioentity line
+    * bioentities is the map { bioentity: (type, taxon) } loaded from the GPI files (see load_gpi)
+    * eco_map is the map { (ECO id, reference or "Default"): GO evidence code } (see load_eco_mapping)
+    * aspects is the map { GO id: aspect } (see load_aspects)
+    """
+    if line.startswith("!"):
+        return None
+    cols = line.rstrip("\n").split("\t")
+    if len(cols) < 10:
+        return None
+    bioentity = cols[0] + ":" + cols[1]
+    if bioentity not in bioentities or cols[3] not in aspects:
+        return None
+    references = split_values(cols[4])
+    evidence = None
+    for reference in references:
+        if (cols[5], reference) in eco_map:
+            evidence = eco_map[(cols[5], reference)]
+            break
+    if evidence is None:
+        evidence = eco_map.get((cols[5], "Default"), cols[5])
+    bioentity_type, taxon = bioentities[bioentity]
+    return {
+        "bioentity" : bioentity,
+        "qualifier" : [qualifier.lower() for qualifier in split_values(cols[2])],
+        "annotation_class" : cols[3],
+        "reference" : references,
+        "evidence_type" : evidence,
+        "aspect" : aspects[cols[3]],
+        "type" : bioentity_type,
+        "taxon" : taxon,
+        "assigned_by" : cols[9]
+    }
+
+def load_ontology(obo_path):
+    """
+    Load the ontology from an OBO or OBO Graphs JSON (eg go.json) file or URL (see go_stats_utils.fetch_obo)
+    """
+    return utils.fetch_obo(obo_path)
+
+def load_gpi(gpi_paths):
+    """
+    Load the GPI 1.2 files into a map { bioentity: (type, taxon) }
+    """
+    bioentities = { }
+    for path in gpi_paths:
+        with open_file(path) as infile:
+            for line in infile:
+                if line.startswith("!"):
+                    continue
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) < 7:
+                    continue
+                bioentities[cols[0] + ":" + cols[1]] = (cols[5], taxon_curie(cols[6].split("|")[0]))
+    return bioentities
+
+def load_eco_mapping(eco_path):
+    """
+    Load the GAF/ECO mapping (ECO id, GO evidence code, reference or Default) into a map { (ECO id, reference or "Default"): GO evidence code }
+    """
+    eco_map = { }
+    with open_file(eco_path) as infile:
+        for line in infile:
+            if line.startswith("#"):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 3:
+                continue
+            eco_map[(cols[0], cols[2])] = cols[1]
+    return eco_map
+
+def load_aspects(ontology):
+    """
+    Return the map { GO id or alternate id: aspect } of an OBO_Parser
+    """
+    aspects = { }
+    for id, term in ontology.get_terms(TermState.ANY).items():
+        if term.namespace not in NAMESPACE_ASPECTS:
+            continue
+        aspects[id] = NAMESPACE_ASPECTS[term.namespace]
+        if term.alt_ids:
+            for alt_id in term.alt_ids:
+                aspects[alt_id] = NAMESPACE_ASPECTS[term.namespace]
+    return aspects
+
+def create_terms_response(ontology):
+    """
+    Return the GO terms of an OBO_Parser as a golr response (see go_stats.fetch_terms)
+    """
+    docs = []
+    for id, term in ontology.get_terms(TermState.ANY).items():
+        if not id.startswith("GO:"):
+            continue
+        doc = { 'annotation_class' : id, 'is_obsolete' : term.is_obsolete is True }
+        if term.namespace:
+            doc['source'] = term.namespace
+        docs.append(doc)
+    return { 'response' : { 'numFound' : len(docs), 'docs' : docs } }
+
+
+
+def add_count(counts, key, count = 1):
+    counts[key] = counts.get(key, 0) + count
+
+def add_aspect_count(counts, key, aspect, count = 1):
+    if key not in counts:
+        counts[key] = [0, 0, 0, 0]
+    values = counts[key]
+    values[0] += count
+    if aspect in ASPECT_INDEX:
+        values[ASPECT_INDEX[aspect]] += count
+
+def subtract_counts(counts, counts_diff):
+    result = { }
+    for key, val in counts.items():
+        if key in counts_diff:
+            diff = counts_diff[key]
+            result[key] = [val[i] - diff[i] for i in range(len(val))] if type(val) == list else val - diff
+        else:
+            result[key] = val
+    return result
+
+
+class AnnotationCounter:
+    """
+    Counts of a set of GO annotations needed to compute the stats including and excluding protein binding (see create_stats)
+    * the direct annotations to protein binding are also counted separately, the stats excluding protein binding being the difference
+    * the per taxon aspect breakdowns (evidences, qualifiers) are only kept for the reference genomes
+    """
+
+    def __init__(self):
+        self.annotations = 0
+        self.annotations_pb = 0
+
+        # { field: { value: number of annotations } }
+        self.facets = { field : { } for field in ANNOTATION_FACETS }
+        self.facets_pb = { field : { } for field in ANNOTATION_FACETS }
+
+        # { (taxon, evidence): [all, P, F, C] }
+        self.evidences = { }
+        self.evidences_pb = { }
+
+        # { (taxon, qualifier): number of annotations }
+        self.qualifiers = { }
+
+        # { taxon or group: set of references }
+        self.references_by_taxon = { }
+        self.references_by_group = { }
+
+        # { bioentity: (type, taxon, aspects mask, only annotated to protein binding) }
+        self.bioentities = { }
+
+
+    def add(self, annotation):
+        """
+        Count an annotation (map using the GOLr annotation fields, see parse_gaf_line)
+        """
+        pb = annotation['annotation_class'] == PROTEIN_BINDING
+        taxon = annotation['taxon']
+        aspect = annotation['aspect']
+
+        self.annotations += 1
+        if pb:
+            self.annotations_pb += 1
+
+        for field in ANNOTATION_FACETS:
+            values = annotation[field]
+            if type(values) != list:
+                values = [values]
+            for value in values:
+                add_count(self.facets[field], value)
+                if pb:
+                    add_count(self.facets_pb[field], value)
+
+        if taxon in reference_genomes_ids:
+            add_aspect_count(self.evidences, (taxon, annotation['evidence_type']), aspect)
+            if pb:
+                add_aspect_count(self.evidences_pb, (taxon, annotation['evidence_type']), aspect)
+            for qualifier in annotation['qualifier']:
+                add_count(self.qualifiers, (taxon, qualifier))
+
+        if taxon not in self.references_by_taxon:
+            self.references_by_taxon[taxon] = set()
+        self.references_by_taxon[taxon].update(annotation['reference'])
+        if annotation['assigned_by'] not in self.references_by_group:
+            self.references_by_group[annotation['assigned_by']] = set()
+        self.references_by_group[annotation['assigned_by']].update(annotation['reference'])
+
+        bioentity = annotation['bioentity']
+        mask = ASPECT_MASK.get(aspect, 0)
+        if bioentity in self.bioentities:
+            btype, btaxon, bmask, bpb = self.bioentities[bioentity]
+            if bmask | mask != bmask or (bpb and not pb):
+                self.bioentities[bioentity] = (btype, btaxon, bmask | mask, bpb and pb)
+        else:
+            self.bioentities[bioentity] = (annotation['type'], taxon, mask, pb)
+
+
+    def add_all(self, annotations):
+        for annotation in annotations:
+            if annotation is not None:
+                self.add(annotation)
+        return self
+
+
+    def merge(self, other):
+        """
+        Add the counts of another AnnotationCounter (the merge is associative and commutative, except for the type / taxon of a bioentity annotated in both, taken from the first one)
+        """
+        self.annotations += other.annotations
+        self.annotations_pb += other.annotations_pb
+
+        for field in ANNOTATION_FACETS:
+            for value, count in other.facets[field].items():
+                add_count(self.facets[field], value, count)
+            for value, count in other.facets_pb[field].items():
+                add_count(self.facets_pb[field], value, count)
+
+        for evidences, other_evidences in [(self.evidences, other.evidences), (self.evidences_pb, other.evidences_pb)]:
+            for key, counts in other_evidences.items():
+                if key in evidences:
+                    evidences[key] = [evidences[key][i] + counts[i] for i in range(len(counts))]
+                else:
+                    evidences[key] = list(counts)
+
+        for key, count in other.qualifiers.items():
+            add_count(self.qualifiers, key, count)
+
+        for references, other_references in [(self.references_by_taxon, other.references_by_taxon), (self.references_by_group, other.references_by_group)]:
+            for key, refs in other_references.items():
+                if key in references:
+                    references[key] |= refs
+                else:
+                    references[key] = set(refs)
+
+        for bioentity, (btype, btaxon, bmask, bpb) in other.bioentities.items():
+            if bioentity in self.bioentities:
+                stype, staxon, smask, spb = self.bioentities[bioentity]
+                self.bioentities[bioentity] = (stype, staxon, smask | bmask, spb and bpb)
+            else:
+                self.bioentities[bioentity] = (btype, btaxon, bmask, bpb)
+
+        return self
+
+
+    def annotations_response(self, exclude_pb_only = False):
+        """
+        Return the counts as the response of go_stats.golr_select_annotations (or golr_select_annotations_no_pbinding)
+        """
+        facet_fields = { }
+        for field in ANNOTATION_FACETS:
+            counts = subtract_counts(self.facets[field], self.facets_pb[field]) if exclude_pb_only else self.facets[field]
+            facet_fields[field] = utils.build_facet_list(counts)
+        total = self.annotations - self.annotations_pb if exclude_pb_only else self.annotations
+        return { 'response' : { 'numFound' : total }, 'facet_counts' : { 'facet_fields' : facet_fields } }
+
+
+    def bioentities_response(self, exclude_pb_only = False):
+        """
+        Return the counts as the response of go_stats.golr_select_bioentities (updated by go_stats.remove_pb_only_bioentities if exclude_pb_only)
+        """
+        types = { }
+        taxa = { }
+        for btype, btaxon, bmask, bpb in self.bioentities.values():
+            add_count(types, btype)
+            add_count(taxa, btaxon)
+        response = { 'response' : { 'numFound' : len(self.bioentities) }, 'facet_counts' : { 'facet_fields' : { 'type' : utils.build_facet_list(types), 'taxon' : utils.build_facet_list(taxa) } } }
+        if exclude_pb_only:
+            pb_docs = ({ 'annotation_class_list' : [PROTEIN_BINDING], 'type' : btype, 'taxon' : btaxon } for btype, btaxon, bmask, bpb in self.bioentities.values() if bpb)
+            go_stats.remove_pb_only_bioentities(response, pb_docs)
+        return response
+
+
+    def references(self):
+        """
+        Return the map { reference: number of annotations } (see go_stats.get_references)
+        """
+        return utils.build_map(utils.build_facet_list(self.facets['reference']))
+
+
+    def fill_shared(self, shared, taxa, groups, evidence_types, qualifiers, exclude_pb_only = False):
+        """
+        Compute the per taxon / per group results used by go_stats.create_stats and store them in shared (same sections as go_stats.fetch_derived)
+        """
+        bioentities = shared.setdefault("bioentities_by_taxon", { })
+        missing = set(taxon for taxon in taxa if taxon not in bioentities)
+        if len(missing) > 0:
+            counts = { }
+            for btype, btaxon, bmask, bpb in self.bioentities.values():
+                if btaxon not in missing:
+                    continue
+                if btaxon not in counts:
+                    counts[btaxon] = { }
+                if btype not in counts[btaxon]:
+                    counts[btaxon][btype] = [0, 0, 0, 0]
+                values = counts[btaxon][btype]
+                values[0] += 1
+                for aspect, index in ASPECT_INDEX.items():
+                    if bmask & ASPECT_MASK[aspect]:
+                        values[index] += 1
+            for taxon in missing:
+                bioentities[taxon] = aspect_facets(counts.get(taxon, { }))
+
+        for section, references_by_key, keys in [("references_by_taxon", self.references_by_taxon, taxa), ("references_by_group", self.references_by_group, groups)]:
+            references = shared.setdefault(section, { })
+            for key in keys:
+                if key not in references:
+                    refs = references_by_key.get(key, set())
+                    references[key] = (len(refs), len([ref for ref in refs if "PMID:" in ref]))
+
+        evidences = subtract_counts(self.evidences, self.evidences_pb) if exclude_pb_only else self.evidences
+        section = shared.setdefault("evidences_by_species_no_pb" if exclude_pb_only else "evidences_by_species", { })
+        for taxon in utils.REFERENCE_GENOME_IDS:
+            if taxon not in section:
+                section[taxon] = aspect_facets({ evidence : counts for (etaxon, evidence), counts in evidences.items() if etaxon == taxon }, evidence_types)
+
+        section = shared.setdefault("qualifiers_by_species", { })
+        for taxon in utils.REFERENCE_GENOME_IDS:
+            if taxon not in section:
+                counts = { qualifier : count for (qtaxon, qualifier), count in self.qualifiers.items() if qtaxon == taxon }
+                section[taxon] = utils.build_map(utils.build_facet_list(counts, list(qualifiers.keys())))
+
+        return shared
+
+
+def aspect_facets(counts, zero_values = None):
+    """
+    Transform { value: [all, P, F, C] } into { value: { "A", "P", "F", "C" } } ordered as the facet of the ALL query (see go_stats.merge_aspect_facets)
+    """
+    all_list = utils.build_facet_list({ value : val[0] for value, val in counts.items() }, zero_values)
+    merged_map = { }
+    for value in all_list[0::2]:
+        val = counts[value] if value in counts else [0, 0, 0, 0]
+        merged_map[value] = { "A" : val[0], "P" : val[1], "F" : val[2], "C" : val[3] }
+    return merged_map
+
+
+
+# default size (bytes) of the ranges of the uncompressed annotation files counted by each process (see create_shards)
+shard_size = 256 * 1024 * 1024
+
+# parser of the annotation lines, set in each process counting shards (see init_worker)
+worker_parse_line = None
+
+def create_shards(annotation_paths, size = None):
+    """
+    Split the annotation files into shards (path, start, end) of about size bytes (default: shard_size)
+    compressed files and URLs can not be split and give one shard each (end = None)
+    """
+    size = size or shard_size
+    shards = []
+    for path in annotation_paths:
+        if utils.is_url(path) or utils.is_compressed(path):
+            shards.append((path, 0, None))
+            continue
+        file_size = os.path.getsize(path)
+        if file_size <= size:
+            shards.append((path, 0, None))
+            continue
+        for start in range(0, file_size, size):
+            shards.append((path, start, min(start + size, file_size)))
+    return shards
+
+def iter_shard_lines(path, start, end):
+    """
+    Generator of the lines of a shard: the lines starting in the byte range [start, end[ of the file, or the whole file if end is None
+    """
+    if end is None:
+        with open_file(path) as infile:
+            yield from infile
+        return
+    with open(path, "rb") as infile:
+        if start > 0:
+            # the line overlapping start belongs to the previous shard
+            infile.seek(start - 1)
+            infile.readline()
+        while infile.tell() < end:
+            line = infile.readline()
+            if not line:
+                break
+            yield line.decode("utf-8", errors = "replace")
+
+def line_parser(annotation_format, gpad_maps = None):
+    """
+    Return the parser of the annotation lines; gpad_maps is (bioentities, eco_map, aspects) for the GPAD files (see parse_gpad_line)
+    """
+    if annotation_format == "gpad":
+        bioentities, eco_map, aspects = gpad_maps
+        return lambda line: parse_gpad_line(line, bioentities, eco_map, aspects)
+    return parse_gaf_line
+
+def load_gpad_maps(gpi_paths, eco_path, ontology):
+    return (load_gpi(gpi_paths), load_eco_mapping(eco_path), load_aspects(ontology))
+
+def init_worker(annotation_format, gpad_maps):
+    """
+    Set the line parser of a process counting shards
+    """
+    global worker_parse_line
+    worker_parse_line = line_parser(annotation_format, gpad_maps)
+
+def count_shard(shard):
+    """
+    Return the AnnotationCounter of a shard (path, start, end)
+    """
+    path, start, end = shard
+    return AnnotationCounter().add_all(worker_parse_line(line) for line in iter_shard_lines(path, start, end))
+
+def merge_counters(counters):
+    """
+    Merge a sequence of AnnotationCounter (partial counts, eg of shards) into one, in the sequence order
+    """
+    merged = AnnotationCounter()
+    for counter in counters:
+        merged.merge(counter)
+    return merged
+
+def count_annotations(annotation_paths, annotation_format = "gaf", gpi_paths = None, eco_path = None, ontology = None, processes = None):
+    """
+    Read once the annotation files (GAF 2.x or GPAD 1.1) and return their AnnotationCounter
+    * the files are split into shards (see create_shards) counted by a pool of processes (default: one per cpu), the partial counters being merged in the shards order
+    * gpi_paths, eco_path and ontology (OBO_Parser) are only needed for the GPAD files
+    """
+    gpad_maps = load_gpad_maps(gpi_paths, eco_path, ontology) if annotation_format == "gpad" else None
+
+    shards = create_shards(annotation_paths)
+    processes = min(processes or os.cpu_count() or 1, len(shards))
+    print("Reading " + str(len(annotation_paths)) + " annotation files (" + str(len(shards)) + " shards) with " + str(processes) + " processes...")
+
+    if processes <= 1:
+        init_worker(annotation_format, gpad_maps)
+        counter = merge_counters(map(count_shard, shards))
+    else:
+        with multiprocessing.Pool(processes, init_worker, (annotation_format, gpad_maps)) as pool:
+            counter = merge_counters(pool.imap(count_shard, shards))
+    print("Done (" + str(counter.annotations) + " annotations read).")
+    return counter
+
+def create_store(annotation_paths, annotation_format = "gaf", gpi_paths = None, eco_path = None, ontology = None):
+    """
+    Read the annotation files (GAF 2.x or GPAD 1.1) into an AnnotationStore (see go_annotation_store), eg to save it and compute the stats later (see count_store)
+    """
+    gpad_maps = load_gpad_maps(gpi_paths, eco_path, ontology) if annotation_format == "gpad" else None
+    parse_line = line_parser(annotation_format, gpad_maps)
+    store = AnnotationStore()
+    for path in annotation_paths:
+        print("Reading annotations from " + path + "...")
+        with open_file(path) as infile:
+            store.add_all(parse_line(line) for line in infile)
+    print("Done (" + str(len(store)) + " annotations read).")
+    return store
+
+def count_store(store, rows = None):
+    """
+    Return the AnnotationCounter of the annotations of an AnnotationStore (or only of the given rows)
+    each breakdown is a single group by over the columns of the store (vectorized if numpy is available, see AnnotationStore.count_by)
+    """
+    counter = AnnotationCounter()
+    pb_rows = store.select(rows, annotation_class = PROTEIN_BINDING)
+    genome_rows = store.select(rows, taxon = utils.REFERENCE_GENOME_IDS)
+    genome_pb_rows = store.select(pb_rows, taxon = utils.REFERENCE_GENOME_IDS)
+
+    counter.annotations = len(store) if rows is None else len(rows)
+    counter.annotations_pb = len(pb_rows)
+    for field in ANNOTATION_FACETS:
+        counter.facets[field] = store.count_by(field, rows)
+        counter.facets_pb[field] = store.count_by(field, pb_rows)
+
+    for evidences, evidence_rows in [(counter.evidences, genome_rows), (counter.evidences_pb, genome_pb_rows)]:
+        for (taxon, evidence, aspect), count in store.count_by(["taxon", "evidence_type", "aspect"], evidence_rows).items():
+            add_aspect_count(evidences, (taxon, evidence), aspect, count)
+    counter.qualifiers = store.count_by(["taxon", "qualifier"], genome_rows)
+
+    for references, field in [(counter.references_by_taxon, "taxon"), (counter.references_by_group, "assigned_by")]:
+        for key in store.count_by(field, rows):
+            references[key] = set()
+        for key, reference in store.count_by([field, "reference"], rows):
+            references[key].add(reference)
+
+    aspects = { }
+    for bioentity, aspect in store.count_by(["bioentity", "aspect"], rows):
+        aspects[bioentity] = aspects.get(bioentity, 0) | ASPECT_MASK.get(aspect, 0)
+    annotations = store.count_by("bioentity", rows)
+    annotations_pb = store.count_by("bioentity", pb_rows)
+    for bioentity, row in store.first_rows("bioentity", rows).items():
+        pb_only = annotations_pb.get(bioentity, 0) == annotations[bioentity]
+        counter.bioentities[bioentity] = (store.value("type", row), store.value("taxon", row), aspects[bioentity], pb_only)
+    return counter
+
+def create_stats(counter, all_terms, release_date, exclude_pb_only = False, shared = None, load_taxon_labels = True):
+    """
+    Create the stats (see go_stats.create_stats) from an AnnotationCounter and the GO terms (see create_terms_response)
+    """
+    all_annotations = counter.annotations_response(exclude_pb_only)
+    all_entities = counter.bioentities_response(exclude_pb_only)
+    qualifiers = utils.build_map(utils.build_facet_list(counter.facets['qualifier']))
+
+    go_stats.prepare_globals(all_annotations, load_taxon_labels)
+    shared = shared if shared is not None else { }
+    evidence_types = utils.build_list(all_annotations['facet_counts']['facet_fields']['evidence_type'])
+    counter.fill_shared(shared, go_stats.usable_taxons, go_stats.groups, evidence_types, qualifiers, exclude_pb_only)
+
+    return go_stats.create_stats(all_terms, all_annotations, all_entities, release_date, qualifiers, exclude_pb_only, None, shared)
+
+def create_stats_variants(counter, all_terms, release_date, load_taxon_labels = True):
+    """
+    Create the stats including and excluding annotations to protein binding only, return (stats, stats_no_pb)
+    """
+    shared = { }
+    print("Creating Stats (including protein binding)...")
+    stats = create_stats(counter, all_terms, release_date, False, shared, load_taxon_labels)
+    print("Creating Stats (excluding protein binding)...")
+    stats_no_pb = create_stats(counter, all_terms, release_date, True, shared, False)
+    return stats, stats_no_pb
+
+def compute_stats_variants(annotation_paths, obo_path, release_date, annotation_format = "gaf", gpi_paths = None, eco_path = None, load_taxon_labels = True, processes = None):
+    """
+    Compute the stats including and excluding annotations to protein binding only from the annotation files and the GO ontology (OBO)
+    processes is the number of processes reading the annotation files (default: one per cpu)
+    return (stats, stats_no_pb)
+    """
+    print("1 / 3 - Loading GO ontology (" + obo_path + ")...")
+    ontology = load_ontology(obo_path)
+    all_terms = create_terms_response(ontology)
+    print("Done.")
+
+    print("2 / 3 - Reading GO annotations...")
+    counter = count_annotations(annotation_paths, annotation_format, gpi_paths, eco_path, ontology, processes)
+    print("Done.")
+
+    print("3 / 3 - Creating Stats...")
+    return create_stats_variants(counter, all_terms, release_date, load_taxon_labels)
+
+
+
+def print_help():
+    print('\nUsage: python go_gaf_stats.py -a <annotation files, comma separated> -g <go.obo> -d <release_date> -o <output_rep> [-f gaf|gpad] [-p <gpi files, comma separated>] [-e <gaf-eco-mapping.txt>] [-n] [-w <processes>] [-s <annotation store>]\n')
+    print('\t-f gpad requires the GPI files (-p) and the ECO mapping (-e)')
+    print('\t-s saves the annotations read from the annotation files in an annotation store, or without -a, computes the stats from a saved annotation store')
+    print('\t-n does not fetch the taxon labels (no network access)')
+    print('\t-w number of processes reading the annotation files (default: one per cpu)\n')
+
+
+def main(argv):
+    annotation_paths = []
+    obo_path = ''
+    output_rep = ''
+    release_date = ''
+    annotation_format = 'gaf'
+    gpi_paths = None
+    eco_path = None
+    load_taxon_labels = True
+    processes = None
+    store_path = None
+
+    if len(argv) < 8:
+        print_help()
+        sys.exit(2)
+
+    try:
+        opts, argv = getopt.getopt(argv,"a:g:o:d:f:p:e:nw:s:",["annotations=","obo=","orep=","date=","format=","gpi=","eco=","nolabels","workers=","store="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print_help()
+            sys.exit()
+        elif opt in ("-a", "--annotations"):
+            annotation_paths = arg.split(",")
+        elif opt in ("-g", "--obo"):
+            obo_path = arg
+        elif opt in ("-o", "--orep"):
+            output_rep = arg
+        elif opt in ("-d", "--date"):
+            release_date = arg
+        elif opt in ("-f", "--format"):
+            annotation_format = arg
+        elif opt in ("-p", "--gpi"):
+            gpi_paths = arg.split(",")
+        elif opt in ("-e", "--eco"):
+            eco_path = arg
+        elif opt in ("-n", "--nolabels"):
+            load_taxon_labels = False
+        elif opt in ("-w", "--workers"):
+            processes = int(arg)
+        elif opt in ("-s", "--store"):
+            store_path = arg
+
+    if annotation_format == "gpad" and (gpi_paths is None or eco_path is None):
+        print_help()
+        sys.exit(2)
+
+    if not output_rep.endswith("/"):
+        output_rep += "/"
+
+    if not os.path.exists(output_rep):
+        os.mkdir(output_rep)
+
+    print("1 / 3 - Loading GO ontology (" + obo_path + ")...")
+    ontology = load_ontology(obo_path)
+    all_terms = create_terms_response(ontology)
+    print("Done.")
+
+    print("2 / 3 - Reading GO annotations...")
+    if store_path and len(annotation_paths) == 0:
+        print("Loading annotation store " + store_path)
+        counter = count_store(AnnotationStore.load(store_path))
+    elif store_path:
+        store = create_store(annotation_paths, annotation_format, gpi_paths, eco_path, ontology)
+        print("Saving annotation store to " + store_path)
+        store.save(store_path)
+        counter = count_store(store)
+    else:
+        counter = count_annotations(annotation_paths, annotation_format, gpi_paths, eco_path, ontology, processes)
+    print("Done.")
+
+    print("3 / 3 - Creating Stats...")
+    json_stats, json_stats_no_pb = create_stats_variants(counter, all_terms, release_date, load_taxon_labels)
+    go_stats.write_stats(output_rep, json_stats, json_stats_no_pb, counter.references())
+
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -1,15 +1,17 @@
 # This script is experimental and is used to produce GMT files out of GO terms
 
-import sys, getopt, os, json
+import sys, getopt, os, gc, json, multiprocessing
 import go_stats_utils as utils
-from obo_parser import OBO_Parser, TermState
+from obo_parser import TermState
+from go_annotation_store import AnnotationStore
 
-max_rows = 10000000
+# number of docs fetched per GOLr request
+page_size = 10000
 
 
 
-select_ontology = "select?fq=document_category:\"ontology_class\"&q=*:*&rows=" + str(max_rows) + "&wt=json&fq=idspace:\"GO\"&fq=is_obsolete:false&fl=annotation_class,annotation_class_label,source,regulates_closure,isa_closure,isa_partof_closure,regulates_closure"
-select_annotations = "select?fq=document_category:\"annotation\"&q=*:*&rows=" + str(max_rows) + "&wt=json&fq=type:\"protein\"&fl=bioentity,annotation_class,evidence_type"
+select_ontology = "select?fq=document_category:\"ontology_class\"&q=*:*&wt=json&fq=idspace:\"GO\"&fq=is_obsolete:false&fl=annotation_class,annotation_class_label,source,regulates_closure,isa_closure,isa_partof_closure,regulates_closure"
+select_annotations = "select?fq=document_category:\"annotation\"&q=*:*&wt=json&fq=type:\"protein\"&fl=bioentity,annotation_class,evidence_type"
 
 ASPECTS = {
     "GO:0003674" : "MF",
@@ -17,50 +19,81 @@ ASPECTS = {
     "GO:0005575" : "CC"
 }
 
+# evidence groups of the (bioentity, evidence group) pairs of the GMTs (see create_go_annotation_codes_map)
+PAIR_GROUPS = [ "EXPERIMENTAL", "COMPUTATIONAL" ]
+
 
 def create_ontology_map(golr_base_url):
-    ontology = utils.golr_fetch(golr_base_url, select_ontology)
-    ontology = ontology['response']['docs']
+    # docs are fetched page by page, the next page being downloaded while the current one is processed
+    ontology = utils.golr_iter_docs(golr_base_url, select_ontology, page_size, True)
     map={}
     for item in ontology:
         map[item['annotation_class']] = item
     return map
 
-def create_go_annotation_map(golr_base_url, taxa):
+def create_ontology_map_from_obo(obo):
     """
-    Create a Map { GO-Term -> [ annotations ] } using the direct annotation to the term (annotation_class)
+    Create the same map as create_ontology_map from an OBO_Parser of GO, the closures being computed locally instead of fetched from GOLr
     """
-    annots = utils.golr_fetch_by_taxa(golr_base_url, select_annotations, taxa)
-    annots = annots['response']['docs']
+    closures = { label.value : obo.get_closures(label.value) for label in utils.CLOSURE_LABELS }
     map={}
-    for item in annots:
-        iclass = item['annotation_class']
-        iannots = []
-        if iclass in map:
-            iannots = map[iclass]
-        else:
-            map[iclass] = iannots
-        iannots.append(item)
+    for id, term in obo.get_terms(TermState.VALID).items():
+        if not id.startswith("GO:"):
+            continue
+        item = { 'annotation_class' : id, 'annotation_class_label' : term.name, 'source' : term.namespace }
+        for closure, terms in closures.items():
+            item[closure] = list(terms[id])
+        map[id] = item
     return map
 
-def remap_go_annotation_map(go_annotation_map, ontology_map, closure):
+def create_annotation_store(golr_base_url, taxa):
     """
-    Remap an existing go annotation map using a certain closure (see CLOSURE_LABELS)
+    Create an AnnotationStore (bioentity, annotation_class, evidence_type) of the protein annotations of taxa
     """
-    new_map = {}
-    for term in go_annotation_map:
-        new_map[term] = []
-        closure_terms = ontology_map[term][closure]
+    store = AnnotationStore(["bioentity", "annotation_class", "evidence_type"], [])
+    return store.add_all(utils.golr_iter_docs(golr_base_url, select_annotations + utils.golr_taxa_filter(taxa), page_size, True))
 
-        for closure_term in closure_terms:
-            # continue only if there is an annotation for that closure term
-            if closure_term not in go_annotation_map:
-                continue
-            # discard annotation to root terms
-            if closure_term in ASPECTS:
-                continue
-            new_map[term] = new_map[term] + go_annotation_map[closure_term]
+def create_go_annotation_codes_map(store, rows = None):
+    """
+    Create a Map { GO-Term -> set of codes } of the direct annotations (rows, default all) of an AnnotationStore to each term, each code being
+    an integer (bioentity, evidence group) pair: bioentity code * len(PAIR_GROUPS) + number of the evidence group in PAIR_GROUPS
+    The ND annotations are discarded, a term with only ND annotations getting an empty set
+    """
+    class_codes = store.codes("annotation_class")
+    bioentity_codes = store.codes("bioentity")
+    evidence_codes = store.codes("evidence_type")
+    # the number of the evidence group of each evidence code of the store (None for ND)
+    group_numbers = [ ]
+    for evidence_type in store.vocabularies["evidence_type"].values:
+        group = utils.get_evidence_min_group(evidence_type)
+        group_numbers.append(PAIR_GROUPS.index(group) if group in PAIR_GROUPS else None)
+
+    codes = { }
+    for row in (range(len(store)) if rows is None else rows):
+        term_codes = codes.get(class_codes[row])
+        if term_codes is None:
+            term_codes = codes[class_codes[row]] = set()
+        group_number = group_numbers[evidence_codes[row]]
+        if group_number is not None:
+            term_codes.add(bioentity_codes[row] * len(PAIR_GROUPS) + group_number)
+    classes = store.vocabularies["annotation_class"]
+    return { classes[code] : term_codes for code, term_codes in codes.items() }
 
+def remap_go_annotation_map(go_annotation_map, ontology_map, closure):
+    """
+    Remap an existing go annotation map { term: annotations } using a certain closure (see CLOSURE_LABELS):
+    each term gets the frozenset of the annotations of the terms of its closure, annotations to root terms being discarded
+    The annotations must be hashable, eg the integer codes of create_go_annotation_codes_map; the sets are merged once per term (no list is copied),
+    and a term whose closure has a single annotated term shares the set of that term
+    """
+    annotation_sets = { term : frozenset(annotations) for term, annotations in go_annotation_map.items() }
+    new_map = {}
+    for term in annotation_sets:
+        merged = [annotation_sets[closure_term] for closure_term in ontology_map[term][closure] if closure_term in annotation_sets and closure_term not in ASPECTS]
+        if len(merged) == 1:
+            new_map[term] = merged[0]
+        else:
+            new_map[term] = frozenset().union(*merged)
     return new_map
 
 def format_id(id):
@@ -68,11 +101,23 @@ def format_id(id):
     # return id.replace("UniProtKB:", "")
 
 
-def gmt(ontology_map, golr_base_url, taxa):
+def gmt(ontology_map, golr_base_url, taxa, store = None):
+    """
+    Create the GMT report { aspect: { evidence group: { term id: GMT line } } } of taxa
+    the annotations are fetched from GOLr, or taken from the protein annotations of taxa in store (AnnotationStore, see go_gaf_stats.create_store)
+    """
     print("\nCreating term annotation map for taxa ", taxa , " ...")
-    go_annotation_map = create_go_annotation_map(golr_base_url, taxa)
+    if store is None:
+        store = create_annotation_store(golr_base_url, taxa)
+        rows = None
+    else:
+        rows = store.select(taxon = taxa, type = "protein")
+    # { term: codes of the (bioentity, evidence group) pairs of its annotations }
+    go_annotation_map = { term : codes for term, codes in create_go_annotation_codes_map(store, rows).items() if term in ontology_map }
     print("Term annotation map created with ", len(go_annotation_map) , " terms")
 
+    bioentities = store.vocabularies["bioentity"]
+
     closure = utils.CLOSURE_LABELS.REGULATES.value
     print("\nRemapping annotations using closure ", closure)
     go_annotation_map = remap_go_annotation_map(go_annotation_map, ontology_map, closure)
@@ -102,21 +147,16 @@ def gmt(ontology_map, golr_base_url, taxa):
             id_set = set()
             id_sets[evgroup] = id_set
 
-        # going through each annotation for the term considered
-        for annot in value:
-            bioentity = annot['bioentity']
-            et = annot['evidence_type']
-
-            # Don't annotate the gene to that term if ND !
-            evgroup = utils.get_evidence_min_group(et)
-            if(evgroup == "ND"):
-                continue
+        # going through each (bioentity, evidence group) pair of the term considered (ND annotations are already discarded)
+        for code in value:
+            bioentity_code, group_number = divmod(code, len(PAIR_GROUPS))
+            bioentity = bioentities[bioentity_code]
 
             # Add all annotations (don't filter by evidence)
             id_sets["ALL"].add(bioentity)
 
             # Add the annotation for the specific group of evidence
-            id_sets[evgroup].add(bioentity)
+            id_sets[PAIR_GROUPS[group_number]].add(bioentity)
 
 
         # Building the report for that term; will add only the term to an evidence group report IF the term has at least one gene
@@ -125,13 +165,14 @@ def gmt(ontology_map, golr_base_url, taxa):
             if len(id_set) == 0:
                 continue
             
+            line = term_label + "%" + term_aspect + "%" + term_id + "\t" + "\t".join(id_set)
             if evgroup not in report["ALL"]:
-                report["ALL"][evgroup] = []         
-            report["ALL"][evgroup].append(term_label + "%" + term_aspect + "%" + term_id + "\t" + "\t".join(id_set))
+                report["ALL"][evgroup] = { }
+            report["ALL"][evgroup][term_id] = line
 
             if evgroup not in report[term_aspect]:
-                report[term_aspect][evgroup] = []
-            report[term_aspect][evgroup].append(term_label + "%" + term_aspect + "%" + term_id + "\t" + "\t".join(id_set))
+                report[term_aspect][evgroup] = { }
+            report[term_aspect][evgroup][term_id] = line
 
         count += 1
 
@@ -139,40 +180,97 @@ def gmt(ontology_map, golr_base_url, taxa):
             print(str(count) + " terms map created...")
     print(str(count) + " terms map created...")
 
-    # Transforming to text
-    for aspect in report:
-        for evgroup in report[aspect]:
-            report[aspect][evgroup] = "\n".join(report[aspect][evgroup])
-
     return report
 
 
 def filter_slim(report, terms):
+    """
+    Return the GMT report (see gmt) restricted to the terms of a slim (set of term ids), the lines keeping the order of the report
+    """
     gmt_slim = { }
     for aspect in report:
         gmt_slim[aspect] = { }
-        for evgroup in report[aspect]:
-            gmt_aspect = report[aspect][evgroup]
-            lines = gmt_aspect.split("\n")
-            for line in lines:
-                # test if the line contains any terms of the slim
-                res = any(ele in line for ele in terms)
-                if res:
-                    if evgroup not in gmt_slim[aspect]:
-                        gmt_slim[aspect][evgroup] = ""    
-                    gmt_slim[aspect][evgroup] += line + "\n"
+        for evgroup, lines in report[aspect].items():
+            slim_lines = { term_id : line for term_id, line in lines.items() if term_id in terms }
+            if len(slim_lines) > 0:
+                gmt_slim[aspect][evgroup] = slim_lines
     return gmt_slim
 
 
 
+# (ontology_map, golr_base_url, store, slim terms, output_rep) of a process creating GMTs (see init_gmt_worker)
+worker_context = None
+
+def init_gmt_worker(ontology_map, golr_base_url, store_path, slim_terms, output_rep):
+    """
+    Set the context of a process creating the GMTs of taxa; with the fork start method, the ontology map and the slim terms are inherited from the parent process without being copied
+    """
+    global worker_context
+    utils.reset_sessions()
+    store = AnnotationStore.load(store_path) if store_path else None
+    worker_context = (ontology_map, golr_base_url, store, slim_terms, output_rep)
+
+def write_gmts(output, report):
+    for aspect in report:
+        for evgroup in report[aspect]:
+            if len(report[aspect][evgroup]) > 0:
+                utils.write_lines(output + "-" + aspect.lower() + "-" + evgroup.lower() + ".gmt", report[aspect][evgroup].values())
+
+def create_taxon_gmts(taxon):
+    """
+    Create and write the GMT files of a taxon and of its slims (<output_rep><taxon id>[-<slim>]-<aspect>-<evidence group>.gmt) in the context of the process
+    """
+    ontology_map, golr_base_url, store, slim_terms, output_rep = worker_context
+    output = output_rep + taxon.split(":")[1]
+    gmt_taxon = gmt(ontology_map, golr_base_url, taxon, store)
+    write_gmts(output, gmt_taxon)
+    for slim_key, terms in slim_terms.items():
+        write_gmts(output + "-" + slim_key, filter_slim(gmt_taxon, terms))
+    return taxon
+
+def create_gmts(ontology_map, golr_base_url, taxa, slim_terms, output_rep, store_path = None, processes = None):
+    """
+    Create the GMT files of taxa and of their slims ({ slim key: set of term ids }), the annotations being fetched from GOLr or read from the annotation store at store_path
+    The taxa are processed by a pool of processes (default: one per cpu, at most one per taxon), each taxon writing its own files
+    """
+    processes = min(processes or os.cpu_count() or 1, len(taxa))
+    print("Creating the GMTs of ", len(taxa), " taxa with ", processes, " processes...")
+    if processes <= 1:
+        init_gmt_worker(ontology_map, golr_base_url, store_path, slim_terms, output_rep)
+        for taxon in map(create_taxon_gmts, taxa):
+            print("GMTs created for ", taxon)
+        return
+
+    # the collector would otherwise touch (and copy in each forked process) the pages of the objects of the ontology map
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    try:
+        with multiprocessing.Pool(processes, init_gmt_worker, (ontology_map, golr_base_url, store_path, slim_terms, output_rep)) as pool:
+            for taxon in pool.imap_unordered(create_taxon_gmts, taxa):
+                print("GMTs created for ", taxon)
+    finally:
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+
+
 def print_help():
-    print('\nUsage: python go_gmt.py -g <golr_base_url> -o <output_rep> -s <slim_base_url>\n')
+    print('\nUsage: python go_gmt.py -g <golr_base_url> -o <output_rep> -s <slim_base_url> [-a <annotation store>] [-b <go_obo_url>] [-x <snapshot_rep>] [-t <taxa, comma separated>] [-w <processes>]\n')
+    print('\t-a uses the annotations of an annotation store (see go_gaf_stats.py -s) instead of GOLr\n')
+    print('\t-b creates the ontology map (labels, aspects and closures) from the GO OBO file instead of GOLr\n')
+    print('\t-x keeps binary snapshots of the parsed slims in snapshot_rep, reused while the slims do not change\n')
+    print('\t-t creates the GMTs of these taxa only (default: all the reference genomes)\n')
+    print('\t-w number of processes creating the GMTs of the taxa (default: one per cpu)\n')
 
 
 def main(argv):
     golr_base_url = ''
     output_rep = ''
     slim_base_url = ''
+    store_path = None
+    go_obo_url = None
+    snapshot_rep = None
+    taxa = utils.REFERENCE_GENOME_IDS
+    processes = None
 
 
     if len(argv) < 6:
@@ -180,7 +278,7 @@ def main(argv):
         sys.exit(2)
 
     try:
-        opts, argv = getopt.getopt(argv,"g:o:s:",["golrurl=","orep=","slim="])
+        opts, argv = getopt.getopt(argv,"g:o:s:a:b:x:t:w:",["golrurl=","orep=","slim=","store=","obo=","snapshot=","taxa=","processes="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -199,6 +297,16 @@ def main(argv):
             slim_base_url = arg
             if not slim_base_url.endswith("/"):
                 slim_base_url = slim_base_url + "/"
+        elif opt in ("-a", "--store"):
+            store_path = arg
+        elif opt in ("-b", "--obo"):
+            go_obo_url = arg
+        elif opt in ("-x", "--snapshot"):
+            snapshot_rep = arg
+        elif opt in ("-t", "--taxa"):
+            taxa = arg.split(",")
+        elif opt in ("-w", "--processes"):
+            processes = int(arg)
 
     if not output_rep.endswith("/"):
         output_rep += "/"
@@ -209,47 +317,28 @@ def main(argv):
 
 
     print("\n1 - Creating ontology map...")
-    ontology_map = create_ontology_map(golr_base_url)
+    if go_obo_url:
+        ontology_map = create_ontology_map_from_obo(utils.fetch_obo(go_obo_url, snapshot_rep))
+    else:
+        ontology_map = create_ontology_map(golr_base_url)
     print("Ontology map created with ", len(ontology_map) , " terms")
 
 
 
     slims = [ "goslim_agr.obo", "goslim_generic.obo", "goslim_chembl.obo" ]
     print("\n2 - Loading ", len(slims), " slims to create the slim-specific GMTs...")
-    slim_obos = { }
+    # { slim key: ids of the valid terms of the slim }
+    slim_terms = { }
 
     for slim in slims:
-        response = utils.fetch(slim_base_url + slim)
-        obo = OBO_Parser(response.text)
-        slim_obos[slim] = obo
-    print("Slims loaded: ", len(slim_obos))
+        obo = utils.fetch_obo(slim_base_url + slim, snapshot_rep)
+        slim_terms[slim.replace(".obo", "")] = frozenset(obo.get_terms(TermState.VALID).keys())
+    print("Slims loaded: ", len(slim_terms))
 
 
 
-    # taxa = utils.REFERENCE_GENOME_IDS
-    taxa = [ "NCBITaxon:9606", "NCBITaxon:10090" ]
     print("\n3 - Creating the GMTs for " , len(taxa) , " taxa")
-    for taxon in taxa:
-        taxon_id = taxon.split(":")[1]
-        gmt_taxon = gmt(ontology_map, golr_base_url, taxon)
-
-        output = output_rep + taxon_id
-
-        for aspect in gmt_taxon:
-            for evgroup in gmt_taxon[aspect]:
-                if len(gmt_taxon[aspect][evgroup]) > 0:
-                    utils.write_text(output + "-" + aspect.lower() + "-" + evgroup.lower() + ".gmt", gmt_taxon[aspect][evgroup])
-
-        for slim_obo in slim_obos:
-            oterms = slim_obos[slim_obo].get_terms(TermState.VALID)
-            terms = oterms.keys()
-            gmt_taxon_slim = filter_slim(gmt_taxon, terms)
-            slim_key = slim_obo.replace(".obo", "")
-
-            for aspect in gmt_taxon_slim:
-                for evgroup in gmt_taxon_slim[aspect]:
-                    if len(gmt_taxon_slim[aspect][evgroup]) > 0:
-                        utils.write_text(output + "-" + slim_key + "-" + aspect.lower() + "-" + evgroup.lower() + ".gmt", gmt_taxon_slim[aspect][evgroup])
+    create_gmts(ontology_map, golr_base_url, taxa, slim_terms, output_rep, store_path, processes)
 
 
 
@@ -1,4 +1,4 @@
-from obo_parser import OBO_Parser, TermState
+from obo_parser import TermState, STRUCTURAL, XREFS, META
 import sys, getopt, os, json
 
 import go_stats_utils as utils
@@ -11,29 +11,31 @@ last_obo = None
 last_date = None
 
 
-def compute_changes(current_obo_url, previous_obo_url):
-    # The new published OBO archive
-    print("Loading current GO ontology (" + current_obo_url + ")...")
-    currentgo = OBO_Parser(utils.fetch(current_obo_url).text)
+def compute_changes(current_obo_url, previous_obo_url, snapshot_rep = None):
+    # The new published OBO archive and a previously published OBO archive, downloaded and parsed concurrently
+    print("Loading current GO ontology (" + current_obo_url + ") and previous GO ontology (" + previous_obo_url + ")...")
+    currentgo, oldgo = utils.fetch_obos([current_obo_url, previous_obo_url], snapshot_rep)
+    return compare_ontologies(currentgo, oldgo)
 
-    # A previously published OBO archive
-    print("Loading previous GO ontology (" + previous_obo_url + ")...")
-    oldgo = OBO_Parser(utils.fetch(previous_obo_url).text)
 
+def compare_ontologies(currentgo, oldgo):
+    """
+    Return the changes report (summary and detailed changes) of two parsed ontologies (OBO_Parser), currentgo being the most recent
+    """
     # New GO Terms
     created = { }
     created_count = 0
-    for id, newterm in currentgo.get_terms().items():                                                                                                                                                                                
-        if not oldgo.has_term(id):
-            if newterm.namespace not in created:
-                created[newterm.namespace] = []
-            created[newterm.namespace].append({ "id": id, "name": newterm.name})
-            created_count += 1
+    for id in currentgo.get_created_terms(oldgo):
+        newterm = currentgo.get_term(id)
+        if newterm.namespace not in created:
+            created[newterm.namespace] = []
+        created[newterm.namespace].append({ "id": id, "name": newterm.name})
+        created_count += 1
     print(str(created_count) + " terms created since last revision")
 
     # Merged GO Terms    
     merged = { }
-    merged_list = []
+    merged_list = set()
     merged_count = 0
     for id, oldterm in oldgo.get_terms().items():                                                                                                                                                                                  
         if not currentgo.has_term(id):
@@ -43,7 +45,7 @@ def compute_changes(current_obo_url, previous_obo_url):
             if len(alts) > 0:
                 merged[oldterm.namespace].append( { "current": alts[0], "previous": { "id": id, "name": oldterm.name } } )
                 merged_count += 1
-                merged_list.append(oldterm.id)
+                merged_list.add(oldterm.id)
     print(str(merged_count) + " terms merged since last revision")
     
     # Obsoleted GO Terms
@@ -58,24 +60,26 @@ def compute_changes(current_obo_url, previous_obo_url):
                 obsoleted[oldterm.namespace].append({ "id": id, "name": oldterm.name})
                 obsoleted_count += 1
     print(str(obsoleted_count) + " terms obsoleted since last revision")
+
+    # Existing GO Terms whose fingerprints differ, only those are compared field by field
+    changed = currentgo.get_changed_terms(oldgo)
     
     # Existing GO Terms with structural changes (is_a, part_of, has_part etc)
     relations_changes = { }
     structural_count = 0
     structural_total_count = 0
-    for id, newterm in currentgo.get_terms().items():
-        if oldgo.has_term(id):                                                                                                                                                                            
-            oldterm = oldgo.get_term(id)
-            if not newterm.structural_equals(oldterm):
-                if newterm.namespace not in relations_changes:
-                    relations_changes[newterm.namespace] = []
-                    
-                reasons = {}
-                for key, reason in newterm.explain_structural_differences(oldterm).items():
-                    reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
-                relations_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
-                structural_count += 1
-                structural_total_count += len(reasons)
+    for id in changed[STRUCTURAL]:
+        newterm = currentgo.get_term(id)
+        oldterm = oldgo.get_term(id)
+        if newterm.namespace not in relations_changes:
+            relations_changes[newterm.namespace] = []
+            
+        reasons = {}
+        for key, reason in newterm.explain_structural_differences(oldterm).items():
+            reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
+        relations_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
+        structural_count += 1
+        structural_total_count += len(reasons)
     print(str(structural_count) + " terms relation changes since last revision")
     
     
@@ -83,38 +87,36 @@ def compute_changes(current_obo_url, previous_obo_url):
     xrefs_changes = { }
     xrefs_count = 0
     xrefs_total_count = 0
-    for id, newterm in currentgo.get_terms().items():
-        if oldgo.has_term(id):                                                                                                                                                                            
-            oldterm = oldgo.get_term(id)
-            if not newterm.xrefs_equals(oldterm):
-                if newterm.namespace not in xrefs_changes:
-                    xrefs_changes[newterm.namespace] = []
-                    
-                reasons = {}
-                for key, reason in newterm.explain_xrefs_differences(oldterm).items():
-                    reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
-                xrefs_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
-                xrefs_count += 1
-                xrefs_total_count += newterm.count_xrefs_differences(oldterm)
+    for id in changed[XREFS]:
+        newterm = currentgo.get_term(id)
+        oldterm = oldgo.get_term(id)
+        if newterm.namespace not in xrefs_changes:
+            xrefs_changes[newterm.namespace] = []
+            
+        reasons = {}
+        for key, reason in newterm.explain_xrefs_differences(oldterm).items():
+            reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
+        xrefs_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
+        xrefs_count += 1
+        xrefs_total_count += newterm.count_xrefs_differences(oldterm)
     print(str(xrefs_count) + " terms xrefs changes since last revision")
 
     # Existing GO Terms with meta changes (synonyms, NO XREFS, definition, etc)
     meta_noxrefs_changes = { }
     meta_noxrefs_count = 0
     meta_noxrefs_total_count = 0
-    for id, newterm in currentgo.get_terms().items():
-        if oldgo.has_term(id):                                                                                                                                                                            
-            oldterm = oldgo.get_term(id)
-            if not newterm.meta_equals(oldterm, False):
-                if newterm.namespace not in meta_noxrefs_changes:
-                    meta_noxrefs_changes[newterm.namespace] = []
-                    
-                reasons = {}
-                for key, reason in newterm.explain_meta_differences(oldterm, False).items():
-                    reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
-                meta_noxrefs_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
-                meta_noxrefs_count += 1                
-                meta_noxrefs_total_count += len(reasons)
+    for id in changed[META]:
+        newterm = currentgo.get_term(id)
+        oldterm = oldgo.get_term(id)
+        if newterm.namespace not in meta_noxrefs_changes:
+            meta_noxrefs_changes[newterm.namespace] = []
+            
+        reasons = {}
+        for key, reason in newterm.explain_meta_differences(oldterm, False).items():
+            reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
+        meta_noxrefs_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
+        meta_noxrefs_count += 1                
+        meta_noxrefs_total_count += len(reasons)
     print(str(meta_noxrefs_count) + " terms meta (NO XREFS) changes since last revision")
  
 
@@ -267,20 +269,21 @@ def count(map):
 
 
 def print_help():
-    print('\nUsage: python go_ontology_changes.py -c <current_obo_url> -p <previous_obo_url> -o <output_rep>\n')
+    print('\nUsage: python go_ontology_changes.py -c <current_obo_url> -p <previous_obo_url> -o <output_rep> [-x <snapshot_rep>]\n')
 
 
 def main(argv):
     current_obo_url = ''
     previous_obo_url = ''
     output_rep = ''
+    snapshot_rep = None
 
     if len(argv) < 6:
         print_help()
         sys.exit(2)
 
     try:
-        opts, argv = getopt.getopt(argv,"c:p:o:",["cobo=","pobo=","orep="])
+        opts, argv = getopt.getopt(argv,"c:p:o:x:",["cobo=","pobo=","orep=","snapshot="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -295,6 +298,8 @@ def main(argv):
             previous_obo_url = arg
         elif opt in ("-o", "-orep"):
             output_rep = arg
+        elif opt in ("-x", "--snapshot"):
+            snapshot_rep = arg
         
     if not output_rep.endswith("/"):
         output_rep += "/"
@@ -308,7 +313,7 @@ def main(argv):
 
     print("Will write ontology changes to " + output_json + " and " + output_tsv)
 
-    json_changes = compute_changes(current_obo_url, previous_obo_url)
+    json_changes = compute_changes(current_obo_url, previous_obo_url, snapshot_rep)
 
     print("Saving Stats to <" + output_json + "> ...")    
     utils.write_json(output_json, json_changes)
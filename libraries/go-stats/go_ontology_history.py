@@ -0,0 +1,277 @@
+# History of the GO terms over a sequence of ontology releases
+# * each release is ingested once, in release order, by comparing it with the previous release (see go_ontology_changes.compare_ontologies)
+# * for each term, the index keeps the events of its versions: the release in which it was created, changed (relations, cross
+#   references or meta statements), obsoleted or merged; two successive events bound a version of the term
+# * the index is saved as JSON and answers the change queries over any range of releases without parsing the OBO files again
+
+import sys, os, getopt, json
+
+import go_stats_utils as utils
+import go_ontology_changes as goc
+
+
+HISTORY_VERSION = 1
+
+# kinds of events, named as the detailed changes of go_ontology_changes.compare_ontologies
+CREATED = "created_terms"
+OBSOLETED = "obsolete_terms"
+MERGED = "merged_terms"
+META = "meta_statements"
+XREFS = "cross_references"
+RELATIONS = "relations"
+EVENT_KINDS = [CREATED, OBSOLETED, MERGED, META, XREFS, RELATIONS]
+
+
+def release_of(obo):
+    """
+    Return the release date of a parsed ontology, from its data-version header (eg releases/2020-04-02)
+    """
+    release = obo.header.get('data-version', "N/A")
+    return release[release.index("/") + 1:] if "/" in release else release
+
+
+class OntologyHistory:
+    """
+    Index of the changes of the GO terms over a sequence of releases
+    * releases: [{ "release", "url", "summary" }] in release order, summary being the changes with the previous release (None for the first one)
+    * terms: { term id: [events] }, each event being { "release", "kind", "namespace", "name" } plus the "changes" of a changed term
+      ({ field: { "current", "previous" } }) or the "current" term a merged term was merged into
+    * previous: parsed ontology of the last ingested release (only kept in memory), the next release is compared to it
+    Terms without any event since the first release are not indexed
+    """
+
+    def __init__(self, releases = None, terms = None):
+        self.releases = releases if releases is not None else []
+        self.terms = terms if terms is not None else { }
+        self.previous = None
+
+
+    @staticmethod
+    def load(path):
+        with open(path) as infile:
+            data = json.load(infile)
+        if data.get("version") != HISTORY_VERSION:
+            raise ValueError(path + " is not a history index of version " + str(HISTORY_VERSION))
+        return OntologyHistory(data["releases"], data["terms"])
+
+
+    def save(self, path):
+        """
+        Save the index as JSON; the file is written atomically so that a crash never leaves a partial index
+        """
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "w") as outfile:
+            json.dump({ "version": HISTORY_VERSION, "releases": self.releases, "terms": self.terms }, outfile)
+        os.replace(temp_path, path)
+
+
+    def get_releases(self):
+        return [release["release"] for release in self.releases]
+
+
+    def last_release(self):
+        return self.releases[-1]["release"] if len(self.releases) > 0 else None
+
+
+    def ingest(self, obo, url = None, release = None):
+        """
+        Add a parsed ontology (OBO_Parser) as the release following the last ingested one; release defaults to its data-version date
+        The first release is only recorded: the history of its terms starts with it
+        """
+        release = release if release else release_of(obo)
+        last = self.last_release()
+        if last is not None and release <= last:
+            raise ValueError("release " + release + " is not after the last ingested release " + last)
+        if last is not None and self.previous is None:
+            raise ValueError("the ontology of the last ingested release (" + last + ") must be loaded first, see update")
+
+        summary = None
+        if self.previous is not None:
+            report = goc.compare_ontologies(obo, self.previous)
+            summary = report["summary"]["changes"]
+            for kind, changes in report["detailed_changes"].items():
+                for namespace, entries in changes.items():
+                    for entry in entries:
+                        self._add_event(release, kind, namespace, entry)
+
+        self.releases.append({ "release": release, "url": url, "summary": summary })
+        self.previous = obo
+        print("history: release " + release + " ingested, " + str(len(self.terms)) + " terms with changes")
+
+
+    def _add_event(self, release, kind, namespace, entry):
+        event = { "release": release, "kind": kind, "namespace": namespace }
+        if kind == MERGED:
+            id = entry["previous"]["id"]
+            event["name"] = entry["previous"]["name"]
+            event["current"] = entry["current"]
+        else:
+            id = entry["id"]
+            event["name"] = entry["name"]
+            if "changes" in entry:
+                event["changes"] = entry["changes"]
+        if id not in self.terms:
+            self.terms[id] = []
+        self.terms[id].append(event)
+
+
+    def update(self, obo_urls, snapshot_rep = None):
+        """
+        Ingest the releases of obo_urls (in release order) that are not in the index yet
+        The ontology of the last ingested release is loaded again from its url if needed (from its snapshot if snapshot_rep is given)
+        """
+        known = set(release["url"] for release in self.releases)
+        obo_urls = [obo_url for obo_url in obo_urls if obo_url not in known]
+        if len(obo_urls) == 0:
+            return
+        if len(self.releases) > 0 and self.previous is None:
+            last_url = self.releases[-1]["url"]
+            if last_url is None:
+                raise ValueError("the url of the last ingested release (" + self.last_release() + ") is unknown")
+            print("Loading last ingested GO ontology (" + last_url + ")...")
+            self.previous = utils.fetch_obo(last_url, snapshot_rep)
+        for obo_url in obo_urls:
+            print("Loading GO ontology (" + obo_url + ")...")
+            self.ingest(utils.fetch_obo(obo_url, snapshot_rep), obo_url)
+
+
+    def _in_range(self, release, since, until):
+        return (since is None or release > since) and (until is None or release <= until)
+
+
+    def get_changes(self, since = None, until = None, kinds = None):
+        """
+        Return the changes of the releases after since and up to until (None for no bound), grouped as the detailed changes
+        of go_ontology_changes.compare_ontologies ({ kind: { namespace: [entries] } }), each entry having the release of the change
+        """
+        changes = { }
+        for kind in (kinds if kinds else EVENT_KINDS):
+            changes[kind] = { }
+        for id, events in self.terms.items():
+            for event in events:
+                if event["kind"] not in changes or not self._in_range(event["release"], since, until):
+                    continue
+                if event["kind"] == MERGED:
+                    entry = { "current": event["current"], "previous": { "id": id, "name": event["name"] } }
+                else:
+                    entry = { "id": id, "name": event["name"] }
+                    if "changes" in event:
+                        entry["changes"] = event["changes"]
+                entry["release"] = event["release"]
+                if event["namespace"] not in changes[event["kind"]]:
+                    changes[event["kind"]][event["namespace"]] = []
+                changes[event["kind"]][event["namespace"]].append(entry)
+        for kind in changes:
+            for entries in changes[kind].values():
+                entries.sort(key = lambda entry: (entry["release"], entry["previous"]["id"] if "previous" in entry else entry["id"]))
+        return changes
+
+
+    def get_term_history(self, id):
+        """
+        Return the events of a term, in release order
+        """
+        return list(self.terms.get(id, []))
+
+
+    def get_last_change(self, id, kinds = None):
+        """
+        Return the last event of a term (of one of kinds if given) or None if it did not change since the first release
+        """
+        for event in reversed(self.terms.get(id, [])):
+            if kinds is None or event["kind"] in kinds:
+                return event
+        return None
+
+
+    def get_versions(self, id):
+        """
+        Return the versions of a term as (first release, last release) intervals, the last release being None for its current version
+        A version starts with the creation or a change of the term and ends with its next event; obsoleted or merged terms have no current version
+        """
+        events = self.terms.get(id, [])
+        if len(events) == 0:
+            return []
+        start = None if events[0]["kind"] == CREATED else self.releases[0]["release"]
+        versions = []
+        releases = []
+        for event in events:
+            if event["release"] not in releases:
+                releases.append(event["release"])
+        for release in releases:
+            kinds = [event["kind"] for event in events if event["release"] == release]
+            if start is not None:
+                versions.append((start, release))
+            start = None if OBSOLETED in kinds or MERGED in kinds else release
+        if start is not None:
+            versions.append((start, None))
+        return versions
+
+
+
+def print_help():
+    print('\nUsage: python go_ontology_history.py -i <history_json> [-a <obo_urls (comma separated, in release order)>] [-x <snapshot_rep>] [-s <since_release>] [-u <until_release>] [-t <term_id>] [-o <output_json>]\n')
+
+
+def main(argv):
+    history_json = ''
+    obo_urls = None
+    snapshot_rep = None
+    since = None
+    until = None
+    term_id = None
+    output_json = None
+
+    if len(argv) < 2:
+        print_help()
+        sys.exit(2)
+
+    try:
+        opts, argv = getopt.getopt(argv,"i:a:x:s:u:t:o:",["index=","add=","snapshot=","since=","until=","term=","output="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print_help()
+            sys.exit()
+        elif opt in ("-i", "--index"):
+            history_json = arg
+        elif opt in ("-a", "--add"):
+            obo_urls = arg.split(",")
+        elif opt in ("-x", "--snapshot"):
+            snapshot_rep = arg
+        elif opt in ("-s", "--since"):
+            since = arg
+        elif opt in ("-u", "--until"):
+            until = arg
+        elif opt in ("-t", "--term"):
+            term_id = arg
+        elif opt in ("-o", "--output"):
+            output_json = arg
+
+    history = OntologyHistory.load(history_json) if os.path.exists(history_json) else OntologyHistory()
+
+    if obo_urls:
+        history.update(obo_urls, snapshot_rep)
+        print("Saving history index to <" + history_json + "> ...")
+        history.save(history_json)
+        print("Done.")
+
+    if term_id:
+        result = { "id": term_id, "last_change": history.get_last_change(term_id), "versions": history.get_versions(term_id), "events": history.get_term_history(term_id) }
+    else:
+        result = { "releases": history.get_releases(), "since": since, "until": until, "changes": history.get_changes(since, until) }
+
+    if output_json:
+        print("Saving changes to <" + output_json + "> ...")
+        utils.write_json(output_json, result)
+        print("Done.")
+    elif term_id or not obo_urls:
+        print(json.dumps(result, indent = 2))
+
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
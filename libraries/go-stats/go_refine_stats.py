@@ -52,18 +52,14 @@ def main(argv):
 
 
     # 1 - Executing go_stats script
-    print("\n\n1a - EXECUTING GO_STATS SCRIPT (INCLUDING PROTEIN BINDING)...\n")
-    json_stats = go_stats.compute_stats(golr_url, release_date)
+    print("\n\n1 - EXECUTING GO_STATS SCRIPT (INCLUDING AND EXCLUDING PROTEIN BINDING)...\n")
+    json_stats, json_stats_no_pb = go_stats.compute_stats_variants(golr_url, release_date)
     # data = None
     # with open('newtest/go-stats.json', 'r') as myfile:
     #     data=myfile.read()
     # json_stats = json.loads(data)
 
 
-    print("DONE.")
-
-    print("\n\n1b - EXECUTING GO_STATS SCRIPT (EXCLUDING PROTEIN BINDING)...\n")
-    json_stats_no_pb = go_stats.compute_stats(golr_url, release_date, True)
     # with open('newtest/go-stats-no-pb.json', 'r') as myfile:
     #     data=myfile.read()
     # json_stats_no_pb = json.loads(data)    
@@ -12,7 +12,7 @@ import go_stats_utils as utils
 
 
 def print_help():
-    print('\nUsage: python go_reports.py -g <current_golr_url> -d <release_date> -s <previous_stats_url> -n <previous_stats_no_pb_url> -c <current_obo_url> -p <previous_obo_url> -r <previous_references_url> -o <output_rep>\n')
+    print('\nUsage: python go_reports.py -g <current_golr_url> -d <release_date> -s <previous_stats_url> -n <previous_stats_no_pb_url> -c <current_obo_url> -p <previous_obo_url> -r <previous_references_url> -o <output_rep> [-w <concurrent_queries>] [-x <cache_rep>]\n')
 
 
 def main(argv):
@@ -24,6 +24,8 @@ def main(argv):
     previous_references_url = ''
     output_rep = ''
     release_date = ''
+    workers = None
+    cache_rep = None
 
     print(len(argv))
     if len(argv) < 16:
@@ -31,7 +33,7 @@ def main(argv):
         sys.exit(2)
 
     try:
-        opts, argv = getopt.getopt(argv,"g:s:n:c:p:o:d:r:",["golrurl=", "pstats=", "pnstats=", "cobo=", "pobo=", "orep=", "date=", "ref="])
+        opts, argv = getopt.getopt(argv,"g:s:n:c:p:o:d:r:w:x:",["golrurl=", "pstats=", "pnstats=", "cobo=", "pobo=", "orep=", "date=", "ref=", "workers=", "cache="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -58,6 +60,10 @@ def main(argv):
             output_rep = arg
         elif opt in ("-d", "--date"):
             release_date = arg
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt in ("-x", "--cache"):
+            cache_rep = arg
 
     if not output_rep.endswith("/"):
         output_rep += "/"
@@ -65,6 +71,9 @@ def main(argv):
     if not os.path.exists(output_rep):
         os.mkdir(output_rep)
 
+    if cache_rep:
+        utils.enable_cache(cache_rep, release = release_date if release_date else None)
+
 
     # actual names of the files to be generated - can change here if needed
     output_stats =  output_rep + "go-stats.json"
@@ -82,21 +91,17 @@ def main(argv):
 
 
     # 1 - Executing go_stats script
-    print("\n\n1a - EXECUTING GO_STATS SCRIPT (INCLUDING PROTEIN BINDING)...\n")
-    json_stats = go_stats.compute_stats(golr_url, release_date)
-    print("DONE.")
-
-    print("\n\n1b - EXECUTING GO_STATS SCRIPT (EXCLUDING PROTEIN BINDING)...\n")
-    json_stats_no_pb = go_stats.compute_stats(golr_url, release_date, True)
+    print("\n\n1a - EXECUTING GO_STATS SCRIPT (INCLUDING AND EXCLUDING PROTEIN BINDING)...\n")
+    json_stats, json_stats_no_pb = go_stats.compute_stats_variants(golr_url, release_date, workers)
     print("DONE.")
 
-    print("\n\n1c - EXECUTING GO_STATS SCRIPT (RETRIEVING PREVIOUS REFERENCES LIST)...\n")
+    print("\n\n1b - EXECUTING GO_STATS SCRIPT (RETRIEVING PREVIOUS REFERENCES LIST)...\n")
     previous_references_ids = utils.fetch(previous_references_url).text
     previous_references_ids = previous_references_ids.split("\n")
     previous_references_ids = list(map(lambda x: x.split("\t")[0], previous_references_ids))
     print("DONE.")
 
-    print("\n\n1d - EXECUTING GO_STATS SCRIPT (CREATING CURRENT REFERENCES LIST)...\n")
+    print("\n\n1c - EXECUTING GO_STATS SCRIPT (CREATING CURRENT REFERENCES LIST)...\n")
     references = go_stats.get_references()
     references_lines = []
     for k,v in references.items():
@@ -114,7 +119,7 @@ def main(argv):
 
     # 2 - Executing go_ontology_changes script
     print("\n\n2 - EXECUTING GO_ONTOLOGY_CHANGES SCRIPT...\n")
-    json_onto_changes = go_ontology_changes.compute_changes(current_obo_url, previous_obo_url)
+    json_onto_changes = go_ontology_changes.compute_changes(current_obo_url, previous_obo_url, os.path.join(cache_rep, "ontology") if cache_rep else None)
     utils.write_json(output_ontology_changes, json_onto_changes)
 
     tsv_onto_changes = go_ontology_changes.create_text_report(json_onto_changes) 
@@ -1,6 +1,6 @@
 # GO Update Statistics
 
-import sys, getopt, os, json
+import sys, getopt, os, json, copy
 from xml.etree import ElementTree
 
 import go_stats_utils as utils
@@ -20,14 +20,19 @@ reference_genomes_ids = utils.REFERENCE_GENOME_IDS
 
 
 # GOLR prepared queries
-golr_select_ontology =  'select?wt=json&fq=document_category:"ontology_class"&fq=id:GO\:*&fq=idspace:"GO"&fl=source,annotation_class,is_obsolete&rows=2000000&q=*:*&facet=true&facet.field=source&facet.limit=1000000&facet.mincount=1'
+golr_select_ontology =  'select?wt=json&fq=document_category:"ontology_class"&fq=id:GO\:*&fq=idspace:"GO"&fl=source,annotation_class,is_obsolete&q=*:*'
 golr_select_annotations = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&facet=true&facet.field=taxon&facet.field=aspect&facet.field=evidence_type&facet.field=assigned_by&facet.field=reference&facet.field=type&facet.limit=1000000&facet.mincount=1&rows=0'
 golr_select_annotations_no_pbinding = golr_select_annotations + "&fq=!annotation_class:\"GO:0005515\"" # to remove only DIRECT annotations to protein binding
 golr_select_bioentities = 'select?fq=document_category:%22bioentity%22&q=*:*&wt=json&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&rows=0'
-golr_select_bioentities_pb = 'select?fq=document_category:"bioentity"&q=*:*&wt=json&rows=100000&fq=annotation_class_list:"GO:0005515"&fl=annotation_class_list,type,taxon'
+golr_select_bioentities_pb = 'select?fq=document_category:"bioentity"&q=*:*&wt=json&fq=annotation_class_list:"GO:0005515"&fl=annotation_class_list,type,taxon'
 golr_select_qualifiers = 'select?fq=document_category:%22annotation%22&q=*:*&rows=0&wt=json&facet=true&facet.field=qualifier&facet.limit=1000000'
 golr_select_references = 'select?fq=document_category:%22annotation%22&q=*:*&rows=0&wt=json&facet=true&facet.field=reference&facet.limit=10000000'
 
+# GOLR prepared pivot queries (solr >= 4 only), giving in one query the counts for all taxa
+golr_pivot_bioentities = 'select?fq=document_category:%22bioentity%22&q=*:*&wt=json&rows=0&facet=true&facet.pivot=taxon,type&facet.limit=1000000&facet.mincount=1'
+golr_pivot_evidences = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&rows=0&facet=true&facet.pivot=taxon,evidence_type&facet.limit=10000'
+golr_pivot_qualifiers = 'select?fq=document_category:%22annotation%22&q=*:*&rows=0&wt=json&facet=true&facet.pivot=taxon,qualifier&facet.limit=1000000'
+
 
 
 # useful grouping of evidences as discussed with Pascale
@@ -60,9 +65,10 @@ bioentity_type_cluster = { }
 reverse_bioentity_type_cluster = { }
 
 
-def compute_stats(golr_url, release_date, exclude_pb_only = False):
+def compute_stats(golr_url, release_date, exclude_pb_only = False, workers = None):
     """
     compute stats on GO annotations - can specify if we include or exclude annotations to protein binding only
+    workers is the number of concurrent GOLr queries (default: go_stats_utils.fetch_workers)
     """
     global golr_base_url
     golr_base_url = golr_url
@@ -70,7 +76,7 @@ def compute_stats(golr_url, release_date, exclude_pb_only = False):
     print("Will use golr url: " , golr_base_url)
 
     print("1 / 4 - Fetching GO terms...")
-    all_terms = utils.golr_fetch(golr_base_url, golr_select_ontology)
+    all_terms = fetch_terms(golr_base_url)
     print("Done.")
     
     print("2 / 4 - Fetching GO annotations...")
@@ -85,45 +91,7 @@ def compute_stats(golr_url, release_date, exclude_pb_only = False):
 
     # we have to manually update the facts of the first query if we want to remove the bioentities annotated only to protein binding
     if exclude_pb_only:
-        all_entities_no_pb = utils.golr_fetch(golr_base_url, golr_select_bioentities_pb)
-        # print(all_entities_no_pb)
-        entities_type_no_pb = { }
-        entities_taxon_no_pb = { }
-
-        count = 0
-
-        for doc in all_entities_no_pb['response']['docs']:
-            if len(doc['annotation_class_list']) > 1:
-                continue
-            count += 1
-            if doc['type'] in entities_type_no_pb:
-                entities_type_no_pb[doc['type']] += 1
-            else:
-                entities_type_no_pb[doc['type']] = 1
-
-            if doc['taxon'] in entities_type_no_pb:
-                entities_taxon_no_pb[doc['taxon']] += 1
-            else:
-                entities_taxon_no_pb[doc['taxon']] = 1
-
-        # finally update the type facet field
-        types = all_entities['facet_counts']['facet_fields']['type']
-        for i in range(0, len(types), 2):
-            ctype = types[i]
-            retr_value = entities_type_no_pb[ctype] if ctype in entities_type_no_pb else 0
-            types[i + 1] = types[i + 1] - retr_value
-        all_entities['facet_counts']['facet_fields']['type'] = types
-
-        all_entities['response']['numFound'] = all_entities['response']['numFound'] - count
-       
-        # and update the taxon facet field
-        taxons = all_entities['facet_counts']['facet_fields']['taxon']
-        for i in range(0, len(taxons), 2):
-            ctaxon = taxons[i]
-            retr_value = entities_taxon_no_pb[ctaxon] if ctaxon in entities_taxon_no_pb else 0
-            taxons[i + 1] = taxons[i + 1] - retr_value
-        all_entities['facet_counts']['facet_fields']['taxon'] = taxons
-    
+        remove_pb_only_bioentities(all_entities, utils.golr_iter_docs(golr_base_url, golr_select_bioentities_pb))
     print("Done.")
 
     qualifiers = utils.golr_fetch(golr_base_url, golr_select_qualifiers)
@@ -134,11 +102,107 @@ def compute_stats(golr_url, release_date, exclude_pb_only = False):
     print("4 / 4 - Creating Stats...")    
     prepare_globals(all_annotations)
     print("\t4a - globals prepared")
-    stats = create_stats(all_terms, all_annotations, all_entities, release_date, qualifiers, exclude_pb_only)
+    stats = create_stats(all_terms, all_annotations, all_entities, release_date, qualifiers, exclude_pb_only, workers)
     print("Done.")
     
     return stats
 
+def compute_stats_variants(golr_url, release_date, workers = None):
+    """
+    compute in a single pass the stats on GO annotations including and excluding annotations to protein binding only
+    the inputs that do not depend on protein binding (terms, bioentities, qualifiers, taxon labels, references by taxon / group) are only fetched once
+    return (stats, stats_no_pb)
+    """
+    global golr_base_url
+    golr_base_url = golr_url
+
+    print("Will use golr url: " , golr_base_url)
+
+    print("1 / 4 - Fetching GO terms...")
+    all_terms = fetch_terms(golr_base_url)
+    print("Done.")
+
+    print("2 / 4 - Fetching GO annotations (including and excluding protein binding)...")
+    all_annotations, all_annotations_no_pb = utils.golr_fetch_all(golr_base_url, [golr_select_annotations, golr_select_annotations_no_pbinding], workers)
+    print("Done.")
+
+    print("3 / 4 - Fetching GO bioentities...")
+    all_entities = utils.golr_fetch(golr_base_url, golr_select_bioentities)
+    all_entities_no_pb = remove_pb_only_bioentities(copy.deepcopy(all_entities), utils.golr_iter_docs(golr_base_url, golr_select_bioentities_pb, prefetch = True))
+    print("Done.")
+
+    qualifiers = utils.golr_fetch(golr_base_url, golr_select_qualifiers)
+    qualifiers = utils.build_map(qualifiers['facet_counts']['facet_fields']['qualifier'])
+
+    # results of the per taxon / per group queries, shared by the two variants
+    shared = { }
+
+    print("4 / 4 - Creating Stats (including protein binding)...")
+    prepare_globals(all_annotations)
+    print("\t4a - globals prepared")
+    stats = create_stats(all_terms, all_annotations, all_entities, release_date, qualifiers, False, workers, shared)
+    print("Done.")
+
+    print("4 / 4 - Creating Stats (excluding protein binding)...")
+    # the taxon labels were already loaded with the first variant and cover all the taxa of the second one
+    prepare_globals(all_annotations_no_pb, False)
+    print("\t4a - globals prepared")
+    stats_no_pb = create_stats(all_terms, all_annotations_no_pb, all_entities_no_pb, release_date, qualifiers, True, workers, shared)
+    print("Done.")
+
+    return stats, stats_no_pb
+
+def fetch_terms(golr_base_url):
+    """
+    fetch all the GO terms, page by page, and return them as a single golr response (numFound and docs)
+    """
+    docs = list(utils.golr_iter_docs(golr_base_url, golr_select_ontology))
+    return { 'response' : { 'numFound' : len(docs), 'docs' : docs } }
+
+def remove_pb_only_bioentities(all_entities, pb_docs):
+    """
+    update (in place) the facets of the bioentities query to remove the bioentities annotated only to protein binding
+    pb_docs is an iterable of the bioentity docs annotated to protein binding (e.g. utils.golr_iter_docs of golr_select_bioentities_pb)
+    """
+    entities_type_no_pb = { }
+    entities_taxon_no_pb = { }
+
+    count = 0
+
+    for doc in pb_docs:
+        if len(doc['annotation_class_list']) > 1:
+            continue
+        count += 1
+        if doc['type'] in entities_type_no_pb:
+            entities_type_no_pb[doc['type']] += 1
+        else:
+            entities_type_no_pb[doc['type']] = 1
+
+        if doc['taxon'] in entities_type_no_pb:
+            entities_taxon_no_pb[doc['taxon']] += 1
+        else:
+            entities_taxon_no_pb[doc['taxon']] = 1
+
+    # finally update the type facet field
+    types = all_entities['facet_counts']['facet_fields']['type']
+    for i in range(0, len(types), 2):
+        ctype = types[i]
+        retr_value = entities_type_no_pb[ctype] if ctype in entities_type_no_pb else 0
+        types[i + 1] = types[i + 1] - retr_value
+    all_entities['facet_counts']['facet_fields']['type'] = types
+
+    all_entities['response']['numFound'] = all_entities['response']['numFound'] - count
+   
+    # and update the taxon facet field
+    taxons = all_entities['facet_counts']['facet_fields']['taxon']
+    for i in range(0, len(taxons), 2):
+        ctaxon = taxons[i]
+        retr_value = entities_taxon_no_pb[ctaxon] if ctaxon in entities_taxon_no_pb else 0
+        taxons[i + 1] = taxons[i + 1] - retr_value
+    all_entities['facet_counts']['facet_fields']['taxon'] = taxons
+
+    return all_entities
+
 def load_taxon_map():
     global taxon_map
     print("Using ", taxon_map_fallback_url , " (created from ftp://ftp.ncbi.nlm.nih.gov/pub/taxonomy/taxdmp.zip) as a fallback to get taxon { id, label }")
@@ -151,7 +215,7 @@ def load_taxon_map():
     check = '9606' in taxon_map and taxon_map['9606'] == 'Homo sapiens'
     return check
 
-def prepare_globals(all_annotations):
+def prepare_globals(all_annotations, load_taxon_labels = True):
     global usable_taxons
     global taxon_map
     global groups
@@ -166,6 +230,20 @@ def prepare_globals(all_annotations):
     usable_taxons = utils.build_list(temp, 1000)
     all_taxons = utils.build_list(temp, None)
 
+    if load_taxon_labels:
+        prepare_taxon_map(all_taxons)
+
+    bioentity_type_cluster = { }
+    temp = all_annotations['facet_counts']['facet_fields']['type']
+    for i in range(0, len(temp), 2):
+        bioentity_types.append(temp[i])
+        bioentity_type_cluster[temp[i]] = utils.bioentity_type(temp[i])
+
+    reverse_bioentity_type_cluster = utils.build_reverse_map(bioentity_type_cluster)
+
+def prepare_taxon_map(all_taxons):
+    global taxon_map
+
     # this step will create the global taxon_map to get any name from an id
     temp_taxons = []
     for taxon in all_taxons:
@@ -197,63 +275,51 @@ def prepare_globals(all_annotations):
         print("Successfully pass taxon label mapping test (taxon_map['9606'] == 'Homo sapiens'): ", taxon_map['9606'] == 'Homo sapiens')
     else:
         print("Taxon map could not be created, will show taxon labels as UNK")
-        
-
-    bioentity_type_cluster = { }
-    temp = all_annotations['facet_counts']['facet_fields']['type']
-    for i in range(0, len(temp), 2):
-        bioentity_types.append(temp[i])
-        bioentity_type_cluster[temp[i]] = utils.bioentity_type(temp[i])
-
-    reverse_bioentity_type_cluster = utils.build_reverse_map(bioentity_type_cluster)
 
     
-def golr_fetch_bioentities_taxon(taxon):
+def golr_queries_bioentities_taxon(taxon):
     url = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&rows=0&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&fq=taxon:\"" + taxon + "\""
-    response = utils.golr_fetch(golr_base_url, url)
 
     # multiple queries: a bit complicated but necessary due to solr 3.6 unable to do composite faceting and for speed considerations
     # * can indicate the is_a closure to find the stats on that specific aspect
     # * if evidence code was present, we could use a similar strategy
     url_bp = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&rows=0&fq=taxon:\"" + taxon + "\"&fq=isa_partof_closure:\"" + BP + "\""
-    response_bp = utils.golr_fetch(golr_base_url, url_bp)
-
     url_mf = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&rows=0&fq=taxon:\"" + taxon + "\"&fq=isa_partof_closure:\"" + MF + "\""
-    response_mf = utils.golr_fetch(golr_base_url, url_mf)
-
     url_cc = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&rows=0&fq=taxon:\"" + taxon + "\"&fq=isa_partof_closure:\"" + CC + "\""
-    response_cc = utils.golr_fetch(golr_base_url, url_cc)
 
-    return { ALL : response, BP : response_bp, MF : response_mf, CC : response_cc }
-    
+    return { ALL : url, BP : url_bp, MF : url_mf, CC : url_cc }
+
+def golr_fetch_bioentities_taxon(taxon, workers = None):
+    return utils.golr_fetch_map(golr_base_url, golr_queries_bioentities_taxon(taxon), workers)
+
+def golr_query_references_taxon(taxon):
+    return "select?fq=document_category:%22annotation%22&q=*:*&wt=json&rows=0&facet.limit=10000000&facet.mincount=1&facet=true&facet.field=reference&fq=taxon:\"" + taxon + "\""
+
 def golr_fetch_references_taxon(taxon):
-    url = "select?fq=document_category:%22annotation%22&q=*:*&wt=json&rows=0&facet.limit=10000000&facet.mincount=1&facet=true&facet.field=reference&fq=taxon:\"" + taxon + "\""
-    response = utils.golr_fetch(golr_base_url, url)
+    response = utils.golr_fetch(golr_base_url, golr_query_references_taxon(taxon))
     return response
 
+def golr_query_references_group(group):
+    return "select?fq=document_category:%22annotation%22&q=*:*&wt=json&rows=0&facet.limit=10000000&facet.mincount=1&facet=true&facet.field=reference&fq=assigned_by:\"" + group + "\""
+
 def golr_fetch_references_group(group):
-    url = "select?fq=document_category:%22annotation%22&q=*:*&wt=json&rows=0&facet.limit=10000000&facet.mincount=1&facet=true&facet.field=reference&fq=assigned_by:\"" + group + "\""
-    response = utils.golr_fetch(golr_base_url, url)
+    response = utils.golr_fetch(golr_base_url, golr_query_references_group(group))
     return response
 
-def golr_fetch_annotation_by_evidence_by_species(taxon, exclude_pb_only):
+def golr_queries_annotation_by_evidence_by_species(taxon, exclude_pb_only):
     options = ""
     if exclude_pb_only:
         options = "&fq=!annotation_class:\"GO:0005515\""
 
     url = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&facet=true&facet.field=evidence_type&facet.limit=10000&rows=0' + options
-    response = utils.golr_fetch(golr_base_url, url)
-
     url_bp = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&facet=true&facet.field=evidence_type&facet.limit=10000&rows=0&fq=isa_partof_closure:\"' + BP + '\"' + options
-    response_bp = utils.golr_fetch(golr_base_url, url_bp)
-
     url_mf = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&facet=true&facet.field=evidence_type&facet.limit=10000&rows=0&fq=isa_partof_closure:\"' + MF + '\"' + options
-    response_mf = utils.golr_fetch(golr_base_url, url_mf)
-
     url_cc = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&facet=true&facet.field=evidence_type&facet.limit=10000&rows=0&fq=isa_partof_closure:\"' + CC + '\"' + options
-    response_cc = utils.golr_fetch(golr_base_url, url_cc)
 
-    return { ALL : response, BP : response_bp, MF : response_mf, CC : response_cc }
+    return { ALL : url, BP : url_bp, MF : url_mf, CC : url_cc }
+
+def golr_fetch_annotation_by_evidence_by_species(taxon, exclude_pb_only, workers = None):
+    return utils.golr_fetch_map(golr_base_url, golr_queries_annotation_by_evidence_by_species(taxon, exclude_pb_only), workers)
     
 
 
@@ -282,7 +348,96 @@ def add_taxon_label(map):
                 new_map[key] = val
     return new_map
 
-def create_stats(all_terms, all_annotations, all_entities, release_date, qualifiers, exclude_pb_only = False):
+def fetch_derived(section, keys, build_queries, derive, workers = None, shared = None):
+    """
+    For each key, fetch the queries { name: query } built by build_queries(key) and compute derive({ name: response })
+    * the keys are processed concurrently (see go_stats_utils.parallel_map) and the results returned as a map following the keys order
+    * if shared is a map, the results already computed for that section are reused and the new ones stored in it
+      (copies are returned as the stats computation alters some of the results, eg cluster_complex_map)
+    """
+    computed = shared.setdefault(section, { }) if shared is not None else { }
+
+    def fetch_key(key):
+        responses = { }
+        for name, query in build_queries(key).items():
+            responses[name] = utils.golr_fetch(golr_base_url, query)
+        return derive(responses)
+
+    missing = [key for key in keys if key not in computed]
+    for key, result in zip(missing, utils.parallel_map(fetch_key, missing, workers)):
+        computed[key] = result
+    if shared is not None:
+        return { key : copy.deepcopy(computed[key]) for key in keys }
+    return { key : computed[key] for key in keys }
+
+def fetch_derived_by_taxon(section, taxa, build_queries, pivot_queries, field, derive, workers = None, shared = None, zero_values = None):
+    """
+    Query planner for the per taxon facets: same as fetch_derived but, if the GOLr instance supports pivot faceting, the
+    per taxon queries { name: query } are replaced by the pivot queries { name: pivot query }, each one giving the facet field for all taxa
+    * zero_values are the facet values to add with a 0 count when missing (the per taxon queries without facet.mincount return all values)
+    * old GOLr instances (solr 3.6) fall back to the per taxon queries
+    * nothing is fetched if shared already contains the results for all the taxa (eg computed from annotation files, see go_gaf_stats)
+    """
+    computed = shared.setdefault(section, { }) if shared is not None else { }
+    missing = [taxon for taxon in taxa if taxon not in computed]
+    if len(missing) > 0 and not utils.golr_capabilities(golr_base_url)["pivot"]:
+        return fetch_derived(section, taxa, build_queries, derive, workers, shared)
+
+    if len(missing) > 0:
+        responses = utils.golr_fetch_map(golr_base_url, pivot_queries, workers)
+        facets = { }
+        for name, response in responses.items():
+            facets[name] = utils.golr_pivot_facets(response, "taxon," + field)
+
+        for taxon in missing:
+            taxon_responses = { }
+            for name in pivot_queries:
+                values = facets[name][taxon] if taxon in facets[name] else []
+                if zero_values:
+                    present = set(values[0::2])
+                    for value in sorted(zero_values):
+                        if value not in present:
+                            values = values + [value, 0]
+                taxon_responses[name] = { 'facet_counts' : { 'facet_fields' : { field : values } } }
+            computed[taxon] = derive(taxon_responses)
+
+    if shared is not None:
+        return { key : copy.deepcopy(computed[key]) for key in taxa }
+    return { key : computed[key] for key in taxa }
+
+def golr_pivot_queries_by_aspect(pivot_query):
+    return {
+        ALL : pivot_query,
+        BP : pivot_query + "&fq=isa_partof_closure:\"" + BP + "\"",
+        MF : pivot_query + "&fq=isa_partof_closure:\"" + MF + "\"",
+        CC : pivot_query + "&fq=isa_partof_closure:\"" + CC + "\""
+    }
+
+def merge_aspect_facets(responses, field):
+    """
+    Merge the facet field of the ALL, BP, MF, CC responses into { value: { "A", "P", "F", "C" } }
+    """
+    all_map = utils.build_map(responses[ALL]['facet_counts']['facet_fields'][field])
+    bp_map = utils.build_map(responses[BP]['facet_counts']['facet_fields'][field])
+    mf_map = utils.build_map(responses[MF]['facet_counts']['facet_fields'][field])
+    cc_map = utils.build_map(responses[CC]['facet_counts']['facet_fields'][field])
+
+    merged_map = {}
+    for key, value in all_map.items():
+        merged_map[key] = { "A" : value , "P" : bp_map[key] if key in bp_map else 0 , "F" : mf_map[key] if key in mf_map else 0 , "C" : cc_map[key] if key in cc_map else 0 }
+    return merged_map
+
+def count_references(responses):
+    """
+    Return the number of (references, pmids) of a reference facet response
+    """
+    res = responses[ALL]
+    references = int(len(res['facet_counts']['facet_fields']['reference']) / 2)
+    pmid_map = utils.build_map(res['facet_counts']['facet_fields']['reference'])
+    pmid_map = len(utils.extract_map(pmid_map, "PMID:"))
+    return references, pmid_map
+
+def create_stats(all_terms, all_annotations, all_entities, release_date, qualifiers, exclude_pb_only = False, workers = None, shared = None):
     stats = { }
 
     terms = 0
@@ -314,73 +469,52 @@ def create_stats(all_terms, all_annotations, all_entities, release_date, qualifi
     }
     print("\t4b - terms computed")
 
-    all_bioentities_by_taxon = { }
+    # all the per taxon / per group queries are independent: they are issued concurrently and read back in a deterministic order
+    all_bioentities_by_taxon = fetch_derived_by_taxon("bioentities_by_taxon", usable_taxons, golr_queries_bioentities_taxon, golr_pivot_queries_by_aspect(golr_pivot_bioentities), "type", lambda responses: merge_aspect_facets(responses, "type"), workers, shared)
     cluster_bioentities_by_taxon = { }
     for taxon in usable_taxons:
-        responses = golr_fetch_bioentities_taxon(taxon)
-        all_map = utils.build_map(responses[ALL]['facet_counts']['facet_fields']['type'])
-        bp_map = utils.build_map(responses[BP]['facet_counts']['facet_fields']['type'])
-        mf_map = utils.build_map(responses[MF]['facet_counts']['facet_fields']['type'])
-        cc_map = utils.build_map(responses[CC]['facet_counts']['facet_fields']['type'])
-
-        merged_map = {}
-        for key, value in all_map.items():
-            merged_map[key] = { "A" : value , "P" : bp_map[key] if key in bp_map else 0 , "F" : mf_map[key] if key in mf_map else 0 , "C" : cc_map[key] if key in cc_map else 0 }
-
-        all_bioentities_by_taxon[taxon] = merged_map
         cluster_bioentities_by_taxon[taxon] =  utils.cluster_complex_map(all_bioentities_by_taxon[taxon], bioentity_type_cluster)
         
         # all_bioentities_by_taxon[taxon] = build_map(res['facet_counts']['facet_fields']['type'])
         # cluster_bioentities_by_taxon[taxon] =  cluster_map(all_bioentities_by_taxon[taxon], bioentity_type_cluster)
     print("\t4c - bioentities computed")
 
+    references = fetch_derived("references_by_taxon", usable_taxons, lambda taxon: { ALL : golr_query_references_taxon(taxon) }, count_references, workers, shared)
     references_by_taxon = { }
     pmids_by_taxon = { }
     for taxon in usable_taxons:
-        res = golr_fetch_references_taxon(taxon)
-        references_by_taxon[taxon] = int(len(res['facet_counts']['facet_fields']['reference']) / 2)
-        pmid_map = utils.build_map(res['facet_counts']['facet_fields']['reference'])
-        pmid_map = len(utils.extract_map(pmid_map, "PMID:"))
-        pmids_by_taxon[taxon] = pmid_map
+        references_by_taxon[taxon], pmids_by_taxon[taxon] = references[taxon]
     references_by_taxon = utils.ordered_map(references_by_taxon)
     pmids_by_taxon = utils.ordered_map(pmids_by_taxon)
     print("\t4d - taxa computed")
 
+    references = fetch_derived("references_by_group", groups, lambda group: { ALL : golr_query_references_group(group) }, count_references, workers, shared)
     references_by_group = { }
     pmids_by_group = { }
     for group in groups:
-        res = golr_fetch_references_group(group)
-        references_by_group[group] = int(len(res['facet_counts']['facet_fields']['reference']) / 2)
-        pmid_map = utils.build_map(res['facet_counts']['facet_fields']['reference'])
-        pmid_map = len(utils.extract_map(pmid_map, "PMID:"))
-        pmids_by_group[group] = pmid_map
+        references_by_group[group], pmids_by_group[group] = references[group]
     references_by_group = utils.ordered_map(references_by_group)
     pmids_by_group = utils.ordered_map(pmids_by_group)
     print("\t4e - references computed")
 
 
 
+    # only those queries depend on protein binding
+    reference_genomes_filter = "&fq=taxon:(\"" + "\" OR \"".join(reference_genomes_ids) + "\")"
+    pivot_evidences = golr_pivot_evidences + reference_genomes_filter + ("&fq=!annotation_class:\"GO:0005515\"" if exclude_pb_only else "")
+    evidence_types = utils.build_list(all_annotations['facet_counts']['facet_fields']['evidence_type'])
+    evidences = fetch_derived_by_taxon("evidences_by_species_no_pb" if exclude_pb_only else "evidences_by_species", reference_genomes_ids, lambda taxon: golr_queries_annotation_by_evidence_by_species(taxon, exclude_pb_only), golr_pivot_queries_by_aspect(pivot_evidences), "evidence_type", lambda responses: merge_aspect_facets(responses, "evidence_type"), workers, shared, evidence_types)
+    qualifiers_by_species = fetch_derived_by_taxon("qualifiers_by_species", reference_genomes_ids, lambda taxon: { ALL : golr_select_qualifiers + "&fq=taxon:\"" + taxon + "\"" }, { ALL : golr_pivot_qualifiers + reference_genomes_filter }, "qualifier", lambda responses: utils.build_map(responses[ALL]['facet_counts']['facet_fields']['qualifier']), workers, shared, list(qualifiers.keys()))
+
     ref_genome_annotation_evidences = { }
     for taxon in reference_genomes_ids:
-        responses = golr_fetch_annotation_by_evidence_by_species(taxon, exclude_pb_only)
-        all_map = utils.build_map(responses[ALL]['facet_counts']['facet_fields']['evidence_type'])
-        bp_map = utils.build_map(responses[BP]['facet_counts']['facet_fields']['evidence_type'])
-        mf_map = utils.build_map(responses[MF]['facet_counts']['facet_fields']['evidence_type'])
-        cc_map = utils.build_map(responses[CC]['facet_counts']['facet_fields']['evidence_type'])
-
-        merged_map = {}
-        for key, value in all_map.items():
-            merged_map[key] = { "A" : value , "P" : bp_map[key] if key in bp_map else 0 , "F" : mf_map[key] if key in mf_map else 0 , "C" : cc_map[key] if key in cc_map else 0 }
-
         ref_genome_annotation_evidences[taxon] = {
-            "by_evidence" : merged_map
+            "by_evidence" : evidences[taxon]
         }
         ref_genome_annotation_evidences[taxon]["by_evidence_cluster"] = utils.cluster_complex_map(ref_genome_annotation_evidences[taxon]["by_evidence"], reverse_evidence_groups)
 
         # adding qualifiers for each model organism
-        response_qualifiers = utils.golr_fetch_by_taxon(golr_base_url, golr_select_qualifiers, taxon)
-        response_qualifiers = response_qualifiers['facet_counts']['facet_fields']['qualifier']
-        ref_genome_annotation_evidences[taxon]["by_qualifier"] = utils.build_map(response_qualifiers)
+        ref_genome_annotation_evidences[taxon]["by_qualifier"] = qualifiers_by_species[taxon]
         
 
     annotations = { 
@@ -600,20 +734,22 @@ def create_meta(json_stats):
     
 
 def print_help():
-    print('\nUsage: python go_stats.py -g <golr_url> -d <release_date> -o <output_rep>\n')
+    print('\nUsage: python go_stats.py -g <golr_url> -d <release_date> -o <output_rep> [-w <concurrent_queries>] [-x <cache_rep>]\n')
 
 
 def main(argv):
     golr_url = ''
     output_rep = ''
     release_date = ''
+    workers = None
+    cache_rep = None
 
     if len(argv) < 6:
         print_help()
         sys.exit(2)
 
     try:
-        opts, argv = getopt.getopt(argv,"g:b:o:d:",["golrurl=","orep=","date="])
+        opts, argv = getopt.getopt(argv,"g:b:o:d:w:x:",["golrurl=","orep=","date=","workers=","cache="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -630,6 +766,10 @@ def main(argv):
             output_rep = arg
         elif opt in ("-d", "--date"):
             release_date = arg
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt in ("-x", "--cache"):
+            cache_rep = arg
 
     if not output_rep.endswith("/"):
         output_rep += "/"
@@ -637,7 +777,18 @@ def main(argv):
     if not os.path.exists(output_rep):
         os.mkdir(output_rep)
 
+    if cache_rep:
+        utils.enable_cache(cache_rep, release = release_date if release_date else None)
+
+    json_stats, json_stats_no_pb = compute_stats_variants(golr_url, release_date, workers)
+    write_stats(output_rep, json_stats, json_stats_no_pb, get_references())
 
+
+def write_stats(output_rep, json_stats, json_stats_no_pb, references):
+    """
+    Write the stats (including and excluding protein binding), their text reports, meta and the PMID files in output_rep
+    references is the map { reference: number of annotations }
+    """
     # actual names of the files to be generated - can change here if needed
     output_meta = output_rep + "go-meta.json"
     output_meta_no_pb = output_rep + "go-meta-no-pb.json"
@@ -649,8 +800,7 @@ def main(argv):
     output_pubmed_pmids = output_rep + "GO.uid"
 
 
-    print("Will write stats to " + output_stats + " and " + output_stats_tsv)
-    json_stats = compute_stats(golr_url, release_date, False)
+    print("Will write stats to " + output_stats + " and " + output_stats_tsv + " (excluding protein binding: " + output_stats_no_pb + " and " + output_stats_no_pb_tsv + ")")
     print("Saving Stats to <" + output_stats + "> ...")    
     utils.write_json(output_stats, json_stats)
     print("Done.")
@@ -661,8 +811,6 @@ def main(argv):
     print("Done.")
 
 
-    print("Will write stats (excluding protein binding) to " + output_stats_no_pb + " and " + output_stats_no_pb_tsv)
-    json_stats_no_pb = compute_stats(golr_url, release_date, True)
     print("Saving Stats to <" + output_stats_no_pb + "> ...")    
     utils.write_json(output_stats_no_pb, json_stats_no_pb)
     print("Done.")
@@ -686,7 +834,6 @@ def main(argv):
 
 
     print("Saving PMID file to <" + output_pmids + "> and PubMed PMID file to <" + output_pubmed_pmids + ">")
-    references = get_references()
     pmids = {k:v for k,v in references.items() if "PMID:" in k}
     pmids_ids = map(lambda x : x.split(":")[1], pmids)
 
@@ -1,8 +1,20 @@
+import os
+import io
 import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import urllib.parse
+from contextlib import contextmanager
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from go_cache import GolrCache
+from obo_parser import load_obo, parse_ontology, decompressed, GZIP_MAGIC, BZ2_MAGIC
 
 # This is a hard coded list of evidence, better organized for readability
 ev_all = ['EXP', 'IDA', 'IMP', 'IGI',  'IPI', 'IEP', 'IGC', 'RCA', 'IBA', 'IKR', 'IC', 'NAS', 'ND', 'TAS', 'HDA', 'HEP', 'HGI', 'HMP', 'ISA', 'ISM', 'ISO', 'ISS', 'IEA']
@@ -71,7 +83,31 @@ def aspect_from_source(source):
 
 global_session = None
 
-def requests_retry(retries = 3, backoff = 0.3, session = None):
+# sessions used by the worker threads of golr_fetch_all (a requests session should not be shared across threads)
+thread_sessions = threading.local()
+
+# default number of concurrent GOLr queries issued by golr_fetch_all
+fetch_workers = 8
+
+# optional persistent cache of the GOLr responses (see enable_cache)
+golr_cache = None
+
+def enable_cache(cache_rep, ttl = 86400, max_size = 2 * 1024 * 1024 * 1024, release = None):
+    """
+    Store the GOLr responses on disk so that identical queries (eg second compute_stats pass, rerun after a crash) do not hit GOLr again
+    If a release is given, the responses are pinned to that release and never expire, otherwise they expire after ttl seconds
+    """
+    global golr_cache
+    golr_cache = GolrCache(cache_rep, ttl, max_size, release)
+    print("Using GOLr cache ", cache_rep, " (release: ", release, ")")
+    return golr_cache
+
+def disable_cache():
+    global golr_cache
+    golr_cache = None
+
+
+def requests_retry(retries = 3, backoff = 0.3, session = None, pool_size = 10):
     session = session or requests.Session()
     retry = Retry(
         total = retries,
@@ -80,30 +116,111 @@ def requests_retry(retries = 3, backoff = 0.3, session = None):
         backoff_factor = backoff,
         status_forcelist = (429, 500, 502, 503, 504)
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_size)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
 
-def fetch(url):
+def fetch(url, stream = False):
     """
     Error proof method to get data from HTTP request
     If an error occured, return None
+    If stream is True, the body is not downloaded until read (eg with iter_content)
     """
     global global_session
 
     # Ensure we are using the same session - creating too many sessions could crash this script
-    if global_session is None:
-        global_session = requests_retry(global_session)
+    if threading.current_thread() is not threading.main_thread():
+        if getattr(thread_sessions, "session", None) is None:
+            thread_sessions.session = requests_retry()
+        session = thread_sessions.session
+    else:
+        if global_session is None:
+            global_session = requests_retry(global_session)
+        session = global_session
 
     try:
-        r = global_session.get(url)
+        r = session.get(url, stream = stream)
         return r
     except Exception as x:
         print("Query GET " , url , " failed: ", x)
         return None
 
+def is_url(source):
+    return source.startswith("http://") or source.startswith("https://")
+
+def open_binary(source):
+    """
+    Open a URL (streamed, decoding its transfer encoding) or a local path as a binary file object
+    """
+    if not is_url(source):
+        return open(source, "rb")
+    r = fetch(source, stream = True)
+    if r is None:
+        raise IOError("could not get " + source)
+    r.raise_for_status()
+    r.raw.decode_content = True
+    # io wrappers (eg TextIOWrapper) must not see the response closed at the end of the body before they read it
+    r.raw.auto_close = False
+    return r.raw
+
+@contextmanager
+def open_text(source):
+    """
+    Open a URL or a local path to a plain, gzip or bz2 text file (detected on its first bytes, whatever its extension) as a text file object
+    The file is decompressed while it is read, as it is downloaded: neither the compressed nor the decompressed content is kept in memory
+    """
+    infile = open_binary(source)
+    try:
+        yield io.TextIOWrapper(decompressed(infile), encoding = "utf-8", errors = "replace")
+    finally:
+        infile.close()
+
+def is_compressed(path):
+    with open(path, "rb") as infile:
+        return infile.read(len(BZ2_MAGIC)).startswith((GZIP_MAGIC, BZ2_MAGIC))
+
+def fetch_obo(obo_url, snapshot_rep = None):
+    """
+    Download (or read if obo_url is a local path) and parse an ontology file, OBO or OBO Graphs JSON (eg go.json), plain, gzip or bz2
+    If snapshot_rep is given, a binary snapshot of the parsed ontology is kept in that directory and reused as long as the downloaded file does not change;
+    the file is then downloaded (streamed) to a temporary file of snapshot_rep, its content hash being needed before it is parsed
+    """
+    if snapshot_rep is None:
+        with open_binary(obo_url) as infile:
+            return parse_ontology(infile)
+    os.makedirs(snapshot_rep, exist_ok = True)
+    snapshot_path = os.path.join(snapshot_rep, hashlib.sha256(obo_url.encode("utf-8")).hexdigest() + ".snapshot")
+    if not is_url(obo_url):
+        return load_obo(obo_url, snapshot_path)
+    handle, download_path = tempfile.mkstemp(suffix = ".download", dir = snapshot_rep)
+    try:
+        with os.fdopen(handle, "wb") as outfile, open_binary(obo_url) as infile:
+            shutil.copyfileobj(infile, outfile, 1024 * 1024)
+        return load_obo(download_path, snapshot_path)
+    finally:
+        os.remove(download_path)
+
+def fetch_obos(obo_urls, snapshot_rep = None, processes = None):
+    """
+    Download and parse several OBO files concurrently, each one in its own process (see fetch_obo)
+    Return the OBO_Parsers in the order of obo_urls; by default one process per cpu, with processes = 1 the files are loaded one after the other
+    """
+    processes = min(processes or os.cpu_count() or 1, len(obo_urls))
+    if processes <= 1:
+        return [fetch_obo(obo_url, snapshot_rep) for obo_url in obo_urls]
+    with ProcessPoolExecutor(max_workers = processes, initializer = reset_sessions) as executor:
+        return list(executor.map(fetch_obo, obo_urls, [snapshot_rep] * len(obo_urls)))
+
+def reset_sessions():
+    """
+    Drop the HTTP sessions inherited from the parent process (their connections must not be shared between processes)
+    """
+    global global_session
+    global_session = None
+    thread_sessions.session = None
+
 def post(url, params):
     global global_session
     global_session = requests_retry(global_session)
@@ -120,24 +237,156 @@ def golr_fetch(golr_base_url, select_query):
     Error proof method to get data from GOLr
     If an HTTP error occurs, return None, otherwise return the json object
     """
+    if golr_cache is not None:
+        content = golr_cache.get(golr_base_url, select_query)
+        if content is not None:
+            return json.loads(content)
+
     r = fetch(golr_base_url + select_query)
     if r is None:
         return None
     response = r.json()
+    if golr_cache is not None and r.status_code == 200:
+        golr_cache.put(golr_base_url, select_query, r.content)
     return response
 
+def parallel_map(function, items, workers = None):
+    """
+    Apply function to each item using at most workers threads (default: fetch_workers)
+    Results are returned in the same order as the items
+    """
+    workers = workers or fetch_workers
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        return list(executor.map(function, items))
+
+def golr_fetch_all(golr_base_url, select_queries, workers = None):
+    """
+    Fetch a list of GOLr queries concurrently, using at most workers threads (default: fetch_workers)
+    Responses are returned in the same order as the queries, a failed query giving None
+    """
+    return parallel_map(lambda query: golr_fetch(golr_base_url, query), select_queries, workers)
+
+def golr_fetch_map(golr_base_url, select_queries, workers = None):
+    """
+    Same as golr_fetch_all but for a map { key: query }; return a map { key: response } keeping the keys order
+    """
+    keys = list(select_queries.keys())
+    responses = golr_fetch_all(golr_base_url, [select_queries[key] for key in keys], workers)
+    return dict(zip(keys, responses))
+
+# features supported by each GOLr instance, detected once per base url (see golr_capabilities)
+golr_server_capabilities = { }
+
+def golr_capabilities(golr_base_url):
+    """
+    Detect the Solr version of a GOLr instance and the query features it supports:
+    * pivot: composite faceting with facet.pivot (Solr >= 4.0)
+    * cursor: deep paging with cursorMark (Solr >= 4.7)
+    An instance not exposing its version is considered as Solr 3.6 (current GOLr), eg neither pivot nor cursor
+    The detection can be overridden by setting golr_server_capabilities[golr_base_url]
+    """
+    if golr_base_url in golr_server_capabilities:
+        return golr_server_capabilities[golr_base_url]
+
+    version = None
+    r = fetch(golr_base_url + "admin/info/system?wt=json")
+    try:
+        if r is not None and r.status_code == 200:
+            version = r.json()['lucene']['solr-spec-version']
+    except (ValueError, KeyError, TypeError):
+        version = None
+
+    numbers = (3, 6)
+    if version:
+        try:
+            numbers = tuple(int(number) for number in version.split(".")[:2])
+        except ValueError:
+            numbers = (3, 6)
+
+    capabilities = {
+        "version" : version,
+        "pivot" : numbers >= (4, 0),
+        "cursor" : numbers >= (4, 7)
+    }
+    print("GOLr instance ", golr_base_url, " uses solr ", version, " - capabilities: ", capabilities)
+    golr_server_capabilities[golr_base_url] = capabilities
+    return capabilities
+
+def golr_pivot_facets(response, pivot):
+    """
+    Transform a facet.pivot response (eg pivot = "taxon,type") into a map { taxon: [type1, count1, type2, count2, ...] }, eg the same layout as a facet field
+    """
+    facets = { }
+    for item in response['facet_counts']['facet_pivot'][pivot]:
+        values = []
+        for sub_item in item.get('pivot', []):
+            values.append(sub_item['value'])
+            values.append(sub_item['count'])
+        facets[item['value']] = values
+    return facets
+
 def golr_fetch_by_taxon(golr_base_url, select_query, taxon):
     return golr_fetch(golr_base_url, select_query + "&fq=taxon:\"" + taxon + "\"")
 
-def golr_fetch_by_taxa(golr_base_url, select_query, taxa):
-    tmp = ""
+def golr_taxa_filter(taxa):
+    """
+    Return the filter query restricting a GOLr query to a taxon or a list of taxa
+    """
     if isinstance(taxa, list):
-        tmp = "&fq=taxon:(\"" + taxa.join("\" ") + "\")"
-    else:
-        tmp = "&fq=taxon:\"" + taxa + "\""
+        return "&fq=taxon:(\"" + "\" OR \"".join(taxa) + "\")"
+    return "&fq=taxon:\"" + taxa + "\""
+
+def golr_fetch_by_taxa(golr_base_url, select_query, taxa):
+    tmp = golr_taxa_filter(taxa)
     print("*** ", golr_base_url + select_query + tmp)
     return golr_fetch(golr_base_url, select_query + tmp)
 
+def golr_iter_docs(golr_base_url, select_query, page_size = 10000, prefetch = False):
+    """
+    Generator of all the docs of a GOLr query (the query should not set rows, start or sort), fetched page_size docs at a time
+    * uses cursorMark deep paging if the GOLr instance supports it (solr >= 4.7), otherwise start/rows paging
+    * if prefetch is True, the next page is downloaded while the current one is consumed
+    """
+    use_cursor = golr_capabilities(golr_base_url)["cursor"]
+
+    def page_query(position):
+        if use_cursor:
+            return select_query + "&rows=" + str(page_size) + "&sort=id%20asc&cursorMark=" + urllib.parse.quote(position, safe = "")
+        return select_query + "&rows=" + str(page_size) + "&start=" + str(position)
+
+    executor = ThreadPoolExecutor(max_workers = 1) if prefetch else None
+    try:
+        position = "*" if use_cursor else 0
+        pending = None
+        while True:
+            response = pending.result() if pending is not None else golr_fetch(golr_base_url, page_query(position))
+            pending = None
+            if response is None:
+                raise IOError("could not fetch GOLr page " + str(position) + " of " + golr_base_url + select_query)
+            docs = response['response']['docs']
+
+            if use_cursor:
+                next_position = response['nextCursorMark']
+                done = len(docs) == 0 or next_position == position
+            else:
+                next_position = position + len(docs)
+                done = len(docs) == 0 or next_position >= response['response']['numFound']
+
+            if not done and executor is not None:
+                pending = executor.submit(golr_fetch, golr_base_url, page_query(next_position))
+
+            for doc in docs:
+                yield doc
+
+            if done:
+                break
+            position = next_position
+    finally:
+        if executor is not None:
+            executor.shutdown(wait = False)
+
 # utility function to build a list from a solr/golr facet array
 def build_list(items_list, min_size = None):
     ls = []
@@ -154,6 +403,20 @@ def build_map(items_list, min_size = None):
             map[items_list[i]] = items_list[i + 1]
     return map
 
+# utility function to transform a map {A: 1, B: 2} into a solr/golr facet array [B, 2, A, 1] (count descending, then value)
+# values with a count of 0 are dropped, unless listed in zero_values (as a facet without mincount would do)
+def build_facet_list(map, zero_values = None):
+    counts = { key : val for key, val in map.items() if val > 0 }
+    if zero_values:
+        for key in zero_values:
+            if key not in counts:
+                counts[key] = 0
+    items_list = []
+    for key in sorted(counts, key = lambda key: (-counts[key], key)):
+        items_list.append(key)
+        items_list.append(counts[key])
+    return items_list
+
 # utility function to build a reverse map: { "a": 1, "b": 1, "c": 2 } -> {1: ["a", "b"], 2: ["c"]}
 def build_reverse_map(map):
     reverse_map = { }
@@ -308,3 +571,12 @@ def write_text(key, content):
             outfile.write(content)
         finally:
             outfile.close()
+
+def write_lines(key, lines, buffer_size = 1024 * 1024):
+    """
+    Write lines (an iterable of str), each one followed by a new line, through a buffered writer instead of joining them in memory
+    """
+    with open(key, 'w', buffering = buffer_size) as outfile:
+        for line in lines:
+            outfile.write(line)
+            outfile.write("\n")
@@ -0,0 +1,120 @@
+# Incremental decoding of large JSON documents (eg OBO Graphs files, see obo_parser) given as an iterator of text / bytes chunks:
+# only the values located at some paths are decoded, one at a time, the rest of the document being skipped
+
+import json
+import codecs
+
+
+class JSONStreamReader:
+    """
+    Minimal incremental reader over an iterator of JSON text / bytes chunks; only keeps the part of the text not yet decoded
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self, size):
+        """
+        Read chunks until at least size more characters are buffered; return False if the stream is exhausted
+        """
+        if self.pos > 0:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        target = len(self.buffer) + size
+        while len(self.buffer) < target:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self.buffer += self.decoder.decode(b"", final = True)
+                self.eof = True
+                return False
+            self.buffer += self.decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        return True
+
+    def peek(self):
+        """
+        Return the next non whitespace character without consuming it ("" at the end of the stream)
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read(1):
+                return ""
+
+    def consume(self, expected):
+        if self.peek() != expected:
+            raise ValueError("invalid JSON stream: expected '" + expected + "' at '" + self.buffer[self.pos:self.pos + 20] + "'")
+        self.pos += 1
+
+    def value(self):
+        """
+        Decode the next JSON value; the buffer is extended (doubling its size) until the value is complete
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # a number or literal ending with the buffer may be truncated
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read(max(65536, len(self.buffer) - self.pos))
+
+
+def iter_json_arrays(chunks, paths):
+    """
+    Stream the items of the JSON arrays located at the given paths (tuples of object keys / array indexes),
+    eg [("response", "docs")] for a solr response or [("graphs", 0, "nodes"), ("graphs", 0, "edges")] for an obographs file
+    Yield (path, item) with each item decoded one at a time; the other parts of the document are skipped
+    A path locating a value that is not an array (eg ("graphs", 0, "meta")) yields (path, value) with the whole value
+    """
+    reader = JSONStreamReader(chunks)
+    targets = set(tuple(path) for path in paths)
+    prefixes = set()
+    for path in targets:
+        for i in range(len(path)):
+            prefixes.add(path[:i])
+
+    def visit(path):
+        char = reader.peek()
+        if path in targets and char == "[":
+            reader.consume("[")
+            while reader.peek() != "]":
+                yield (path, reader.value())
+                if reader.peek() == ",":
+                    reader.consume(",")
+            reader.consume("]")
+        elif path in targets:
+            yield (path, reader.value())
+        elif path in prefixes and char == "{":
+            reader.consume("{")
+            while reader.peek() != "}":
+                key = reader.value()
+                reader.consume(":")
+                yield from visit(path + (key,))
+                if reader.peek() == ",":
+                    reader.consume(",")
+            reader.consume("}")
+        elif path in prefixes and char == "[":
+            reader.consume("[")
+            index = 0
+            while reader.peek() != "]":
+                yield from visit(path + (index,))
+                index += 1
+                if reader.peek() == ",":
+                    reader.consume(",")
+            reader.consume("]")
+        else:
+            reader.value()
+
+    yield from visit(())
@@ -1,8 +1,20 @@
 import networkx as nx
 import re
+import io
+import os
+import gc
+import gzip
+import bz2
+import pickle
+import hashlib
+
+from types import MappingProxyType
+from collections import deque
 
 from enum import Enum
 
+from json_stream import iter_json_arrays
+
 import requests
 import sys
 
@@ -13,22 +25,42 @@ class TermState:
     MERGED = 4
 
 def value(var):
+    if isinstance(var, tuple):
+        return list(var)
     return var if var is not None else "N/A"
     
 def relationValue(array):
+    """
+    Return the (relation, target id) pairs of a term as a list of "relation target_id"
+    """
     if array is None:
         return "N/A"
+    return [relation + " " + target_id for relation, target_id in array]
     
     
-    
-class NamedEntity:
-    
-    def __init__(self):
-        self.id = None
-        self.label = None
-    
-    
+def append(values, value):
+    """
+    Return the tuple values (None if empty) extended with value
+    """
+    if values is None:
+        return (value, )
+    return values + (value, )
+
+
+def fingerprint(*fields):
+    """
+    Return a 128 bits digest of fields (strings, booleans, None or tuples of those): equal fields have the same fingerprint
+    """
+    return hashlib.blake2b(repr(fields).encode("utf-8"), digest_size = 16).digest()
+
+
 class Term:
+    """
+    Term of an OBO file; its ids are interned and its multi valued fields are tuples (None when empty)
+    relationship and intersection_of are tuples of (relation, target id) pairs
+    """
+
+    __slots__ = ("id", "alt_ids", "is_obsolete", "is_a", "namespace", "name", "comment", "synonyms", "definition", "created_by", "creation_date", "subsets", "xrefs", "intersection_of", "relationship")
     
     def __init__(self):
         self.id = None
@@ -94,85 +126,34 @@ class Term:
         
         
     def has_alt_id(self, query):
-        if self.alt_ids is None:
-            return False
-        for id in self.alt_ids:
-            if id == query:
-                return True
-        return False
+        return self.alt_ids is not None and query in self.alt_ids
         
         
     def add_intersection_of(self, relationship, target_id, target_label):
-        if self.intersection_of is None:
-            self.intersection_of = []
-
-        relation = Relation()
         if relationship == "":
-            relation.name = "is_a"
-        else:
-            relation.name = relationship
-
-#        print("relation: " + relation.name + " id: " + target_id + " label: " + target_label)
-
-        target = NamedEntity()
-        target.id = target_id
-        target.label = target_label
-        
-        relationTarget = RelationTarget()
-        relationTarget.relation = relation
-        relationTarget.target = target
-        
-#        self.intersection_of.append(relationTarget)
-        self.intersection_of.append(relation.name + " " + target_id)
+            relationship = "is_a"
+        self.intersection_of = append(self.intersection_of, (sys.intern(relationship), sys.intern(target_id)))
         
     def add_relationship(self, relationship, target_id, target_label):
-        if self.relationship is None:
-            self.relationship = []
-
-        relation = Relation()
         if relationship == "":
-            relation.name = "is_a"
-        else:
-            relation.name = relationship
-
-#        print("relation: " + relation.name + " id: " + target_id + " label: " + target_label)
-
-        target = NamedEntity()
-        target.id = target_id
-        target.label = target_label
-        
-        relationTarget = RelationTarget()
-        relationTarget.relation = relation
-        relationTarget.target = target
-        
-#        self.relationship.append(relationTarget)
-        self.relationship.append(relation.name + " " + target_id)
+            relationship = "is_a"
+        self.relationship = append(self.relationship, (sys.intern(relationship), sys.intern(target_id)))
         
         
     def add_is_a(self, is_a):
-        if self.is_a is None:
-            self.is_a = []
-        self.is_a.append(is_a)
+        self.is_a = append(self.is_a, sys.intern(is_a))
         
     def add_alternate_id(self, alt_id):
-        if self.alt_ids is None:
-            self.alt_ids = []
-        self.alt_ids.append(alt_id)
+        self.alt_ids = append(self.alt_ids, sys.intern(alt_id))
         
     def add_synonym(self, synonym):
-        if self.synonyms is None:
-            self.synonyms = []
-        self.synonyms.append(synonym)
+        self.synonyms = append(self.synonyms, synonym)
         
     def add_subset(self, subset):
-        if self.subsets is None:
-            self.subsets = []
-        self.subsets.append(subset)
+        self.subsets = append(self.subsets, sys.intern(subset))
         
     def add_xref(self, xref):
-        if self.xrefs is None:
-            self.xrefs = []
-        self.xrefs.append(xref)
+        self.xrefs = append(self.xrefs, xref)
 
     def equals(self, other):
         return self.id == other.id and self.is_obsolete == other.is_obsolete and self.alt_ids == other.alt_ids and self.name == other.name and self.is_a == other.is_a and self.namespace == other.namespace and self.definition == other.definition and self.comment == other.comment and self.synonyms == other.synonyms and self.subsets == other.subsets and self.xrefs == other.xrefs and self.relationship == other.relationship and self.intersection_of == other.intersection_of
@@ -188,14 +169,23 @@ class Term:
     def xrefs_equals(self, other):
         return self.xrefs == other.xrefs
 
+    def fingerprints(self):
+        """
+        Return the (structural, xrefs, meta) fingerprints of the term: two terms have the same fingerprint
+        if they are structural_equals, xrefs_equals or meta_equals (without xrefs) respectively
+        """
+        return (fingerprint(self.is_a, self.relationship, self.intersection_of),
+                fingerprint(self.xrefs),
+                fingerprint(self.id, self.is_obsolete, self.alt_ids, self.name, self.namespace, self.definition, self.comment, self.synonyms, self.subsets))
+
     def explain_structural_differences(self, other):
         reasons = {}
         if self.is_a != other.is_a:
             reasons["is_a"] = {"current": value(self.is_a), "previous": value(other.is_a) }
         if self.relationship != other.relationship:
-            reasons["relationship"] = {"current": value(self.relationship), "previous": value(other.relationship) }
+            reasons["relationship"] = {"current": relationValue(self.relationship), "previous": relationValue(other.relationship) }
         if self.intersection_of != other.intersection_of:
-            reasons["intersection_of"] = {"current": value(self.intersection_of), "previous": value(other.intersection_of) }
+            reasons["intersection_of"] = {"current": relationValue(self.intersection_of), "previous": relationValue(other.intersection_of) }
         return reasons
 
     def explain_xrefs_differences(self, other):
@@ -282,9 +272,9 @@ class Term:
         if self.is_a != other.is_a:
             reasons["is_a"] = {"current": value(self.is_a), "previous": value(other.is_a) }
         if self.relationship != other.relationship:
-            reasons["relationship"] = {"current": value(self.relationship), "previous": value(other.relationship) }
+            reasons["relationship"] = {"current": relationValue(self.relationship), "previous": relationValue(other.relationship) }
         if self.intersection_of != other.intersection_of:
-            reasons["intersection_of"] = {"current": value(self.intersection_of), "previous": value(other.intersection_of) }
+            reasons["intersection_of"] = {"current": relationValue(self.intersection_of), "previous": relationValue(other.intersection_of) }
         return reasons
         
     def __str__(self):
@@ -303,154 +293,593 @@ class Relation:
         return self.id + "\t" + self.name
 
 
-class RelationTarget:
+# first bytes of the compressed files
+GZIP_MAGIC = b"\x1f\x8b"
+BZ2_MAGIC = b"BZh"
 
-    def __init__(self):
-        id = None
-        relation = None # Relation
-        target = None   # NamedEntity
+def decompressed(infile):
+    """
+    Return a binary file object reading infile (binary) decompressed on the fly if it is gzip or bz2 compressed, detected on its first bytes
+    """
+    if not hasattr(infile, "peek"):
+        infile = io.BufferedReader(infile)
+    magic = infile.peek(len(BZ2_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj = infile)
+    if magic.startswith(BZ2_MAGIC):
+        return bz2.BZ2File(infile)
+    return infile
+
+
+def iter_lines(content):
+    """
+    Iterate over the lines (without line ending) of an OBO document given as a string, bytes (plain, gzip or bz2), a file object or an iterator of lines (str or bytes)
+    """
+    if isinstance(content, str):
+        content = io.StringIO(content)
+    elif isinstance(content, bytes):
+        content = decompressed(io.BytesIO(content))
+    for line in content:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        yield line.rstrip("\r\n")
+
+
+def iter_chunks(content, size = 1024 * 1024):
+    """
+    Iterate over the chunks (str or bytes) of a document given as a string, bytes (plain, gzip or bz2), a file object or an iterator of chunks
+    """
+    if isinstance(content, str):
+        yield content
+        return
+    if isinstance(content, bytes):
+        content = decompressed(io.BytesIO(content))
+    if not hasattr(content, "read"):
+        yield from content
+        return
+    while True:
+        chunk = content.read(size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def is_obographs(infile):
+    """
+    Return True if a binary file object (see decompressed) starts with a JSON object (OBO Graphs document, eg go.json) rather than an OBO header
+    """
+    return infile.peek(64).lstrip().startswith(b"{")
+
+
+def header_item(line):
+    kv = re.split(":(?=\s)", line)
+    return kv[0].strip(), kv[1].strip()
+
+
+def read_header(content):
+    """
+    Return the header { tag: value } of an OBO document, reading only the lines before its first stanza
+    """
+    header = { }
+    for line in iter_lines(content):
+        if line.startswith("["):
+            break
+        if len(line) > 0:
+            key, value = header_item(line)
+            header[key] = value
+    return header
+
+
+def file_hash(path):
+    """
+    Return the sha256 (hex) of a file, read by chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# version of the binary snapshots (see OBO_Parser.save_snapshot); to increase whenever the parsed classes change
+SNAPSHOT_VERSION = 3
+
+# kinds of changes of a term, indexes of its fingerprints (see Term.fingerprints)
+STRUCTURAL = 0
+XREFS = 1
+META = 2
+
+# relations of the typed edges of the ontology graph (OBO_Parser.obo_graph); relationship lines can add other relations
+IS_A = "is_a"
+PART_OF = "part_of"
+HAS_PART = "has_part"
+REGULATES = "regulates"
+POSITIVELY_REGULATES = "positively_regulates"
+NEGATIVELY_REGULATES = "negatively_regulates"
+
+# OBO Graphs IRIs (see OBO_Parser._parse_obographs)
+OBO_PURL = "http://purl.obolibrary.org/obo/"
+OBO_IN_OWL = "http://www.geneontology.org/formats/oboInOwl#"
+OBOGRAPHS_PATHS = {
+    "meta" : ("graphs", 0, "meta"),
+    "nodes" : ("graphs", 0, "nodes"),
+    "edges" : ("graphs", 0, "edges"),
+    "definitions" : ("graphs", 0, "logicalDefinitionAxioms")
+}
+SYNONYM_SCOPES = {
+    "hasExactSynonym" : "EXACT",
+    "hasBroadSynonym" : "BROAD",
+    "hasNarrowSynonym" : "NARROW",
+    "hasRelatedSynonym" : "RELATED"
+}
+# OBO names of the relations used by GO, when the document does not declare their shorthand
+RELATION_NAMES = {
+    "BFO:0000050" : PART_OF,
+    "BFO:0000051" : HAS_PART,
+    "BFO:0000066" : "occurs_in",
+    "RO:0002211" : REGULATES,
+    "RO:0002212" : NEGATIVELY_REGULATES,
+    "RO:0002213" : POSITIVELY_REGULATES
+}
+
+def curie(iri):
+    """
+    Return the OBO id of an OBO PURL, eg GO:0000001 for http://purl.obolibrary.org/obo/GO_0000001 (other values are returned unchanged)
+    """
+    if iri.startswith(OBO_PURL):
+        local = iri[len(OBO_PURL):]
+        prefix, sep, number = local.partition("_")
+        if sep and "/" not in local and "#" not in local:
+            return prefix + ":" + number
+    return iri
+
+def fragment(iri):
+    """
+    Return the part of an IRI after its '#', eg goslim_yeast for http://purl.obolibrary.org/obo/go#goslim_yeast
+    """
+    return iri.rsplit("#", 1)[-1]
+
+def obo_quoted(text):
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def obo_xrefs(xrefs):
+    return "[" + ", ".join(xrefs or ()) + "]"
+
+def property_values(meta):
+    """
+    Return the (pred, val) of the basicPropertyValues of an OBO Graphs meta, the oboInOwl preds being shortened (eg hasOBONamespace)
+    """
+    values = []
+    for item in meta.get("basicPropertyValues", ()):
+        pred = item.get("pred", "")
+        if pred.startswith(OBO_IN_OWL):
+            pred = pred[len(OBO_IN_OWL):]
+        values.append((pred, item.get("val")))
+    return values
+
+
+# relations followed by each closure (same names and semantics as the GOLr closure fields, see go_stats_utils.CLOSURE_LABELS)
+CLOSURE_RELATIONS = {
+    "isa_closure" : (IS_A, ),
+    "isa_partof_closure" : (IS_A, PART_OF),
+    "regulates_closure" : (IS_A, PART_OF, REGULATES, POSITIVELY_REGULATES, NEGATIVELY_REGULATES)
+}
 
 
-# TODO: I have to add the is_a: term_id ! term_name but I have to add it in the edges of the graph
 # TODO: I can also add the consider (who link to other term_ids)
-# TODO: Other relations: intersection_of, relationship
 class OBO_Parser:
+    """
+    obo_graph is a directed graph of the terms, with an edge from each term to its parents (is_a and relationship lines)
+    whose 'relations' attribute is the tuple of the relations between them (eg ("is_a", ) or ("is_a", "part_of"))
+    """
     
     term_key = "[Term]"
     type_def_key = "[Typedef]"
     header = None
     obo_graph = None
     relation_graph = None
+    content_hash = None     # sha256 of the parsed document if known (see load_obo)
+    alt_id_index = None     # { alt_id: [term ids] }
+    namespace_index = None  # { namespace: [term ids] }
+    state_index = None      # { TermState: [term ids] }
+    children_index = None   # { term id: set of valid terms having an is_a to that term }
+    fingerprint_index = None    # { term id: (structural, xrefs, meta) fingerprints }
+    cache = None            # memoized views and counts, dropped when the graph is modified
     
-    def __init__(self, content):
-        self.content = content
-        self.obo_graph = nx.Graph()
+    def __init__(self, content, obographs = False):
+        """
+        Parse an OBO document given as a string, bytes, a file object or an iterator of lines
+        The document is read line by line, in one pass: only the current stanza is kept in memory
+        With obographs = True, content is an OBO Graphs JSON document (eg go.json, or an iterator of its chunks) giving the same terms (see _parse_obographs)
+        """
+        self.obo_graph = nx.DiGraph()
         self.relation_graph = nx.Graph()
         self.header = { }
-        self._parseHeader()
-        self._parseTerms()
-        self._parseRelations()
+        if obographs:
+            self._parse_obographs(content)
+        else:
+            self._parse(content)
+        self.invalidate()
+        print(self.header)
         print("oboparser: ", len(self.obo_graph) , " terms")
-            
-            
-    def _parseHeader(self):
-        lines = self.content.split(self.term_key)[0].split("\n")
-        for line in lines:
+
+
+    def _parse(self, content):
+        stanza = None
+        entity = None
+        for line in iter_lines(content):
             if len(line) == 0:
                 continue
-            kv = re.split(":(?=\s)", line)
-#            print("line: " , line , " kv: ", kv)
-            self.header[kv[0].strip()] = kv[1].strip()
-        print(self.header)
 
+            if line.startswith("["):
+                self._addEntity(entity)
+                stanza = line.strip()
+                if stanza == self.term_key:
+                    entity = Term()
+                elif stanza == self.type_def_key:
+                    entity = Relation()
+                else:
+                    entity = None
+                continue
 
-    def _parseTerms(self):
-        terms = self.content.split(self.term_key)
-        for i in range(1, len(terms)):
-            term = Term()
+            if stanza is None:
+                self._parseHeaderLine(line)
+            elif stanza == self.term_key:
+                self._parseTermLine(entity, line)
+            elif stanza == self.type_def_key:
+                self._parseRelationLine(entity, line)
+        self._addEntity(entity)
 
-            for line in terms[i].split("\n"):
-                if len(line) == 0:
-                    continue
-                
-                if line.startswith(self.type_def_key):
-                    break
-                
-                value = re.split(":(?=\s)", line)[1].strip()
-                if line.startswith("id"):
-                    term.id = value
-                elif line.startswith("alt_id"):
-                    term.add_alternate_id(value)
-                elif line.startswith("namespace"):
-                    term.namespace = value
-                elif line.startswith("name"):
-                    term.name = value
-                elif line.startswith("comment"):
-                    term.comment = value
-                elif line.startswith("def"):
-                    term.definition = value
-                elif line.startswith("synonym"):
-                    term.add_synonym(value)
-                elif line.startswith("subset"):
-                    term.add_subset(value)
-                elif line.startswith("is_obsolete"):
-                    term.is_obsolete = value
-                    if term.is_obsolete == "true":
-                        term.is_obsolete = True
-                elif line.startswith("xref"):
-                    term.add_xref(value)
-                elif line.startswith("is_a"):
-                    term.add_is_a(value.split(" ! ")[0].strip())
-                elif line.startswith("relationship"):
-                    split = value.split("GO:")
-                    split2 = split[1].split(" ! ");
-                    target_id = "GO:" + split2[0].strip()
-                    target_label = split2[1].strip()
-                    term.add_relationship(split[0].strip(), target_id, target_label)
-                elif line.startswith("intersection_of"):
-                    split = value.split("GO:")
-                    split2 = split[1].split(" ! ");
-                    target_id = "GO:" + split2[0].strip()
-                    target_label = split2[1].strip()
-                    term.add_intersection_of(split[0].strip(), target_id, target_label)
-
-            self.obo_graph.add_node(term.id, object=term)
-            
-
-    def _parseRelations(self):
-        relations = self.content.split(self.type_def_key)
-
-        for i in range(1, len(relations)):
-            relation = Relation()
-
-            for line in relations[i].split("\n"):
-                if len(line) == 0:
+
+    def _parse_obographs(self, content):
+        """
+        Build the terms from the nodes of the first graph of an OBO Graphs document, decoded one at a time, and from its explicit edges and logical definitions
+        The fields are rendered as in the OBO format (eg def: "text" [xrefs], synonym: "text" EXACT [xrefs], relation shorthands),
+        so that the ontologies loaded from both formats can be compared; the edges are kept as ids until all the nodes are known
+        """
+        relation_names = dict(RELATION_NAMES)
+        edges = []
+        definitions = []
+        for path, item in iter_json_arrays(iter_chunks(content), OBOGRAPHS_PATHS.values()):
+            if path == OBOGRAPHS_PATHS["nodes"]:
+                if item.get("type") == "PROPERTY":
+                    relation = self._obographs_relation(item)
+                    relation_names[curie(item["id"])] = relation.id
+                    self._addEntity(relation)
+                elif item.get("type", "CLASS") == "CLASS" and "lbl" in item:
+                    self._addEntity(self._obographs_term(item))
+            elif path == OBOGRAPHS_PATHS["edges"]:
+                edges.append((curie(item["sub"]), item["pred"], curie(item["obj"])))
+            elif path == OBOGRAPHS_PATHS["definitions"]:
+                definitions.append(item)
+            else:
+                self._obographs_header(item)
+
+        nodes = self.obo_graph.nodes
+        for sub, pred, obj in edges:
+            if sub not in nodes:
+                continue
+            if pred == IS_A:
+                nodes[sub]['object'].add_is_a(obj)
+            else:
+                relation = curie(pred)
+                nodes[sub]['object'].add_relationship(relation_names.get(relation, relation), obj, None)
+        for definition in definitions:
+            id = curie(definition.get("definedClassId", ""))
+            if id not in nodes:
+                continue
+            term = nodes[id]['object']
+            for genus in definition.get("genusIds", ()):
+                term.add_intersection_of(IS_A, curie(genus), None)
+            for restriction in definition.get("restrictions", ()):
+                relation = curie(restriction["propertyId"])
+                term.add_intersection_of(relation_names.get(relation, relation), curie(restriction["fillerId"]), None)
+
+
+    def _obographs_header(self, meta):
+        # eg "version": "http://purl.obolibrary.org/obo/go/releases/2020-04-02/go.json" for "data-version: releases/2020-04-02"
+        version = meta.get("version", "")
+        parts = version[len(OBO_PURL):].split("/")
+        if version.startswith(OBO_PURL) and len(parts) > 2:
+            self.header["data-version"] = "/".join(parts[1:-1])
+        for pred, val in property_values(meta):
+            if pred == "http://www.w3.org/2002/07/owl#versionInfo":
+                self.header.setdefault("data-version", val)
+            elif pred in ("date", "default-namespace", "saved-by"):
+                self.header[pred] = val
+
+
+    def _obographs_term(self, node):
+        term = Term()
+        term.id = sys.intern(curie(node["id"]))
+        term.name = node["lbl"]
+        meta = node.get("meta", { })
+        if meta.get("deprecated"):
+            term.is_obsolete = True
+        if "definition" in meta:
+            term.definition = obo_quoted(meta["definition"].get("val", "")) + " " + obo_xrefs(meta["definition"].get("xrefs"))
+        if meta.get("comments"):
+            term.comment = meta["comments"][0]
+        for subset in meta.get("subsets", ()):
+            term.add_subset(fragment(subset))
+        for synonym in meta.get("synonyms", ()):
+            text = obo_quoted(synonym.get("val", "")) + " " + SYNONYM_SCOPES.get(synonym.get("pred"), "RELATED")
+            if synonym.get("synonymType"):
+                text += " " + fragment(synonym["synonymType"])
+            term.add_synonym(text + " " + obo_xrefs(synonym.get("xrefs")))
+        for xref in meta.get("xrefs", ()):
+            term.add_xref(xref["val"])
+        for pred, val in property_values(meta):
+            if pred == "hasOBONamespace":
+                term.namespace = sys.intern(val)
+            elif pred == "hasAlternativeId":
+                term.add_alternate_id(val)
+            elif pred == "created_by":
+                term.created_by = val
+            elif pred == "creation_date":
+                term.creation_date = val
+        return term
+
+
+    def _obographs_relation(self, node):
+        # the OBO name of a relation is its declared shorthand, else the GO name of its id (RELATION_NAMES), else its id
+        relation = Relation()
+        relation.id = RELATION_NAMES.get(curie(node["id"]), curie(node["id"]))
+        relation.name = node.get("lbl", relation.id)
+        for pred, val in property_values(node.get("meta", { })):
+            if pred == "shorthand":
+                relation.id = val
+            elif pred == "hasOBONamespace":
+                relation.namespace = val
+        return relation
+
+
+    def _addEntity(self, entity):
+        if isinstance(entity, Term):
+            self.obo_graph.add_node(entity.id, object=entity)
+        elif isinstance(entity, Relation):
+            self.relation_graph.add_node(entity.id, object=entity)
+
+
+    def invalidate(self):
+        """
+        Rebuild the edges and the indexes and drop the memoized views, counts and closures
+        Must be called if obo_graph or one of its terms is modified directly (add_term and remove_term already do)
+        """
+        self._buildEdges()
+        self._buildIndexes()
+        self.cache = { }
+
+
+    def _cached(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+
+    def add_term(self, term):
+        self.obo_graph.add_node(term.id, object=term)
+        self.invalidate()
+
+
+    def remove_term(self, query):
+        if self.has_term(query):
+            self.obo_graph.remove_node(query)
+            self.invalidate()
+
+
+    def _buildEdges(self):
+        """
+        Add the typed edges of the is_a and relationship lines of the terms (edges to terms missing from the document are ignored)
+        """
+        self.obo_graph.remove_edges_from(list(self.obo_graph.edges))
+        edges = { }
+        for id, data in self.obo_graph.nodes(data=True):
+            term = data['object']
+            targets = [(IS_A, parent) for parent in term.is_a] if term.is_a else []
+            if term.relationship:
+                targets += term.relationship
+            for relation, parent in targets:
+                if parent not in self.obo_graph:
                     continue
-                
-                value = line.split(":")[1].strip()
-                if line.startswith("id"):
-                    relation.id = value
-                elif line.startswith("name"):
-                    relation.name = value
-                elif line.startswith("namespace"):
-                    relation.namespace = value
-                elif line.startswith("xref"):
-                    relation.xref = value
-                elif line.startswith("is_transitive"):
-                    relation.is_transitive = value
-
-            self.relation_graph.add_node(relation.id, object=relation)
-            
-            
+                relations = edges.get((id, parent), ())
+                if relation not in relations:
+                    edges[(id, parent)] = relations + (relation, )
+        self.obo_graph.add_edges_from((id, parent, { 'relations': relations }) for (id, parent), relations in edges.items())
+
+
+    def _buildIndexes(self):
+        """
+        Index the parsed terms by alternate id, namespace, state and parent (is_a), to answer the term queries without scanning the graph,
+        and compute their fingerprints, to compare two versions of the ontology without comparing the terms field by field
+        """
+        self.alt_id_index = { }
+        self.namespace_index = { }
+        self.state_index = { TermState.ANY: [], TermState.VALID: [], TermState.OBSOLETED: [] }
+        self.children_index = { }
+        self.fingerprint_index = { }
+        for id, data in self.obo_graph.nodes(data=True):
+            term = data['object']
+            self.fingerprint_index[id] = term.fingerprints()
+            if term.alt_ids:
+                for alt_id in term.alt_ids:
+                    if alt_id not in self.alt_id_index:
+                        self.alt_id_index[alt_id] = []
+                    self.alt_id_index[alt_id].append(id)
+            if term.namespace not in self.namespace_index:
+                self.namespace_index[term.namespace] = []
+            self.namespace_index[term.namespace].append(id)
+            self.state_index[TermState.ANY].append(id)
+            if term.is_obsolete:
+                self.state_index[TermState.OBSOLETED].append(id)
+            else:
+                self.state_index[TermState.VALID].append(id)
+                if term.is_a:
+                    for parent in term.is_a:
+                        if parent not in self.children_index:
+                            self.children_index[parent] = set()
+                        self.children_index[parent].add(term)
+
+
+    def _parseHeaderLine(self, line):
+        key, value = header_item(line)
+        self.header[key] = value
+
+
+    def _parseTermLine(self, term, line):
+        value = re.split(":(?=\s)", line)[1].strip()
+        if line.startswith("id"):
+            term.id = sys.intern(value)
+        elif line.startswith("alt_id"):
+            term.add_alternate_id(value)
+        elif line.startswith("namespace"):
+            term.namespace = sys.intern(value)
+        elif line.startswith("name"):
+            term.name = value
+        elif line.startswith("comment"):
+            term.comment = value
+        elif line.startswith("def"):
+            term.definition = value
+        elif line.startswith("synonym"):
+            term.add_synonym(value)
+        elif line.startswith("subset"):
+            term.add_subset(value)
+        elif line.startswith("is_obsolete"):
+            term.is_obsolete = value
+            if term.is_obsolete == "true":
+                term.is_obsolete = True
+        elif line.startswith("xref"):
+            term.add_xref(value)
+        elif line.startswith("is_a"):
+            term.add_is_a(value.split(" ! ")[0].strip())
+        elif line.startswith("relationship"):
+            split = value.split("GO:")
+            split2 = split[1].split(" ! ");
+            target_id = "GO:" + split2[0].strip()
+            target_label = split2[1].strip()
+            term.add_relationship(split[0].strip(), target_id, target_label)
+        elif line.startswith("intersection_of"):
+            split = value.split("GO:")
+            split2 = split[1].split(" ! ");
+            target_id = "GO:" + split2[0].strip()
+            target_label = split2[1].strip()
+            term.add_intersection_of(split[0].strip(), target_id, target_label)
+
+
+    def _parseRelationLine(self, relation, line):
+        value = line.split(":")[1].strip()
+        if line.startswith("id"):
+            relation.id = value
+        elif line.startswith("name"):
+            relation.name = value
+        elif line.startswith("namespace"):
+            relation.namespace = value
+        elif line.startswith("xref"):
+            relation.xref = value
+        elif line.startswith("is_transitive"):
+            relation.is_transitive = value
+
+
+    def __getstate__(self):
+        # the memoized views are rebuilt on demand
+        state = dict(self.__dict__)
+        state.pop("cache", None)
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cache = { }
+
+
+    def save_snapshot(self, path):
+        """
+        Save the parsed ontology as a binary snapshot, keyed on its data-version and content hash (see load_snapshot)
+        """
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "wb") as outfile:
+            pickle.dump((SNAPSHOT_VERSION, self.header.get("data-version"), self.content_hash), outfile, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self, outfile, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+
+    @staticmethod
+    def load_snapshot(path, content_hash = None, data_version = None):
+        """
+        Load a binary snapshot saved by save_snapshot
+        Return None if there is no snapshot, or if it was saved by another snapshot version, or for another content hash / data-version (if given)
+        """
+        try:
+            with open(path, "rb") as infile:
+                version, snapshot_data_version, snapshot_hash = pickle.load(infile)
+                if version != SNAPSHOT_VERSION:
+                    return None
+                if content_hash is not None and content_hash != snapshot_hash:
+                    return None
+                if data_version is not None and data_version != snapshot_data_version:
+                    return None
+
+                # the collector would otherwise repeatedly scan the many objects being created
+                gc_enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    return pickle.load(infile)
+                finally:
+                    if gc_enabled:
+                        gc.enable()
+        except (OSError, EOFError, ValueError, TypeError, AttributeError, pickle.UnpicklingError):
+            return None
+
+
     def get_nodes(self):
         return self.obo_graph.nodes(data=True)
 
 
     def get_terms(self, term_state = TermState.VALID):
+        """
+        Return a read only map { id: term } of the terms in that state (memoized)
+        """
+        return self._cached(("terms", term_state), lambda: MappingProxyType(self._terms(term_state)))
+
+    def _terms(self, term_state):
         map = { }
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                map[id] = data['object']
+        nodes = self.obo_graph.nodes
+        for id in self.state_index.get(term_state, []):
+            map[id] = nodes[id]['object']
         return map
         
         
     def get_terms_in(self, aspect, term_state = TermState.VALID):
-        list = []
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                if data['object'].namespace == aspect:
-                    list.append(data['object'].id)
-        return list
+        """
+        Return the tuple of the ids of the terms of a namespace in that state (memoized)
+        """
+        return self._cached(("terms_in", aspect, term_state), lambda: tuple(self._terms_in(aspect, term_state)))
+
+    def _terms_in(self, aspect, term_state):
+        if term_state not in self.state_index:
+            return []
+        if term_state == TermState.ANY:
+            return self.namespace_index.get(aspect, [])
+        nodes = self.obo_graph.nodes
+        obsolete = term_state == TermState.OBSOLETED
+        return [id for id in self.namespace_index.get(aspect, []) if bool(nodes[id]['object'].is_obsolete) == obsolete]
         
     def get_merged_terms(self, term_state = TermState.VALID):
-        list = set()
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                if data['object'].alt_ids:
-                    for alt_id in data['object'].alt_ids:
-                        if self.term_used_as_alternate(alt_id):
-                            list.add(data['object'].id)
-        return list
+        """
+        Return the frozenset of the ids of the terms in that state having alternate ids (memoized)
+        """
+        return self._cached(("merged", term_state), lambda: frozenset(self._merged_terms(term_state)))
+
+    def _merged_terms(self, term_state):
+        merged = set()
+        nodes = self.obo_graph.nodes
+        for id in self.state_index.get(term_state, []):
+            alt_ids = nodes[id]['object'].alt_ids
+            if alt_ids:
+                for alt_id in alt_ids:
+                    if self.term_used_as_alternate(alt_id):
+                        merged.add(id)
+        return merged
         
     def has_term(self, query):
         return self.obo_graph.has_node(query)
@@ -463,56 +892,333 @@ class OBO_Parser:
         
     
     def term_used_as_alternate(self, query):
-        for id, data in self.obo_graph.nodes(data=True):
-            if data['object'].has_alt_id(query):
-                return True
-        return False
+        return query in self.alt_id_index
         
     def get_alternate_terms(self, query):
         list = []
-        for id, data in self.obo_graph.nodes(data=True):
-            if data['object'].has_alt_id(query):
-                list.append({ "id": data['object'].id , "name": data['object'].name })
+        nodes = self.obo_graph.nodes
+        for id in self.alt_id_index.get(query, []):
+            term = nodes[id]['object']
+            list.append({ "id": term.id , "name": term.name })
         return list
         
     def count_all_metas(self, term_state = TermState.VALID, includeXRefs = True):
-        count = 0
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                count += data['object'].count_metas(includeXRefs)
-        return count
+        return self._cached(("metas", term_state, includeXRefs), lambda: sum(term.count_metas(includeXRefs) for term in self.get_terms(term_state).values()))
                 
     def count_all_xrefs(self, term_state = TermState.VALID):
-        count = 0
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                count += data['object'].count_xrefs()
-        return count
+        return self._cached(("xrefs", term_state), lambda: sum(term.count_xrefs() for term in self.get_terms(term_state).values()))
         
     def count_all_structurals(self, term_state = TermState.VALID):
-        count = 0
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                count += data['object'].count_structurals()
-        return count
+        return self._cached(("structurals", term_state), lambda: sum(term.count_structurals() for term in self.get_terms(term_state).values()))
 
-    def get_children(self, root):
-        children = set()
-        for id, data in self.obo_graph.nodes(data=True):
-            current = data['object']
-            if current.is_obsolete:
-                continue
-            if current.is_a is None:
+    def get_created_terms(self, other):
+        """
+        Return the ids of the valid terms that are not in other (a previous version of the ontology), in the order of get_terms
+        """
+        return [id for id in self.state_index[TermState.VALID] if id not in other.fingerprint_index]
+
+    def get_changed_terms(self, other):
+        """
+        Return { STRUCTURAL: ids, XREFS: ids, META: ids }, the valid terms also in other (a previous version of the ontology)
+        whose structural, xrefs or meta fingerprint differs, in the order of get_terms
+        """
+        changes = { STRUCTURAL: [], XREFS: [], META: [] }
+        previous_fingerprints = other.fingerprint_index
+        for id in self.state_index[TermState.VALID]:
+            previous = previous_fingerprints.get(id)
+            current = self.fingerprint_index[id]
+            if previous is None or previous == current:
                 continue
-            if root.id in current.is_a:
-                children.add(current)
-                # locals = self.get_children(current)
-                # for local in locals:
-                #     children.add(local)
-        return children
+            for kind, ids in changes.items():
+                if current[kind] != previous[kind]:
+                    ids.append(id)
+        return changes
+
+    def get_children(self, root):
+        return set(self.children_index.get(root.id, ()))
+
+    def get_parents(self, query, relations = None):
+        """
+        Return the ids of the direct parents of a term through one of relations (any relation if None)
+        """
+        if not self.has_term(query):
+            return []
+        return [parent for parent, data in self.obo_graph.succ[query].items() if relations is None or any(relation in relations for relation in data['relations'])]
+
+    def topological_order(self, relations = None):
+        """
+        Return the tuple of all the term ids, each term coming after its parents through relations (any relation if None) (memoized)
+        Raise a ValueError if these relations have a cycle
+        """
+        return self._cached(("order", relations), lambda: self._topological_order(relations))
+
+    def _topological_order(self, relations):
+        # Kahn's algorithm, starting from the terms without parents
+        pending = { }
+        children = { }
+        for id in self.obo_graph:
+            parents = self.get_parents(id, relations)
+            pending[id] = len(parents)
+            for parent in parents:
+                if parent not in children:
+                    children[parent] = []
+                children[parent].append(id)
+
+        queue = deque(id for id, count in pending.items() if count == 0)
+        order = []
+        while queue:
+            id = queue.popleft()
+            order.append(id)
+            for child in children.get(id, ()):
+                pending[child] -= 1
+                if pending[child] == 0:
+                    queue.append(child)
+
+        if len(order) < len(pending):
+            unordered = [id for id, count in pending.items() if count > 0]
+            raise ValueError("the relations " + str(relations) + " have a cycle: " + str(len(unordered)) + " terms are in or under it, eg " + ", ".join(unordered[:5]))
+        return tuple(order)
+
+    def get_closures(self, closure):
+        """
+        Return a read only map { term id: sorted tuple of the ids of the term and of all its ancestors } for a closure of CLOSURE_RELATIONS (memoized)
+        """
+        return self._cached(("closures", closure), lambda: MappingProxyType(self._closures(CLOSURE_RELATIONS[closure])))
+
+    def _closures(self, relations):
+        # the ancestors of a term are merged from its parents, all processed before it in topological order
+        closures = { }
+        for id in self.topological_order(relations):
+            ancestors = { id }
+            for parent in self.get_parents(id, relations):
+                ancestors.update(closures[parent])
+            closures[id] = tuple(sorted(ancestors))
+        return closures
+
+    def get_ancestor_index(self, closure = "regulates_closure"):
+        """
+        Return the AncestorIndex of a closure of CLOSURE_RELATIONS (memoized)
+        """
+        return self._cached(("ancestor_index", closure), lambda: AncestorIndex(self, closure))
+
+    def get_closure(self, query, closure):
+        """
+        Return the sorted tuple of the ids of a term and of all its ancestors for a closure of CLOSURE_RELATIONS (empty if the term does not exist)
+        """
+        return self.get_closures(closure).get(query, ())
+
+
+def numbers_bitset(numbers, size):
+    """
+    Return the int bitset of numbers (all lower than size)
+    """
+    data = bytearray((size + 7) // 8)
+    for number in numbers:
+        data[number >> 3] |= 1 << (number & 7)
+    return int.from_bytes(data, "little")
+
+
+def bit_numbers(bits):
+    """
+    Return the numbers of the bits set in an int bitset, in increasing order
+    """
+    numbers = []
+    # lowest bit first
+    text = bin(bits)[:1:-1]
+    number = text.find("1")
+    while number >= 0:
+        numbers.append(number)
+        number = text.find("1", number + 1)
+    return numbers
+
+
+class AncestorIndex:
+    """
+    Ancestors of the terms of an OBO_Parser for a closure of CLOSURE_RELATIONS, as int bitsets over the terms numbered in topological order
+    A term has a greater number than all its ancestors, so its bitset (the term and its ancestors) only spans the numbers up to its own
+    """
+
+    def __init__(self, obo, closure = "regulates_closure"):
+        relations = CLOSURE_RELATIONS[closure]
+        self.closure = closure
+        self.ids = obo.topological_order(relations)
+        self.numbers = { id: number for number, id in enumerate(self.ids) }
+        self.ancestors = []
+        self.children = [[] for id in self.ids]
+        self.descendants_cache = { }
+        for number, id in enumerate(self.ids):
+            bits = 1 << number
+            for parent in obo.get_parents(id, relations):
+                parent_number = self.numbers[parent]
+                bits |= self.ancestors[parent_number]
+                self.children[parent_number].append(number)
+            self.ancestors.append(bits)
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def __contains__(self, id):
+        return id in self.numbers
+
+
+    def bitset(self, ids):
+        """
+        Return the bitset of the numbers of ids (the ids missing from the index are ignored)
+        """
+        return numbers_bitset([self.numbers[id] for id in ids if id in self.numbers], len(self.ids))
+
+
+    def to_ids(self, bits):
+        """
+        Return the ids of the terms of a bitset, in topological order
+        """
+        return [self.ids[number] for number in bit_numbers(bits)]
+
+
+    def is_a(self, id, ancestor):
+        """
+        Return True if ancestor is id or one of its ancestors (False if one of them is not in the index)
+        """
+        number = self.numbers.get(id)
+        ancestor_number = self.numbers.get(ancestor)
+        if number is None or ancestor_number is None or ancestor_number > number:
+            return False
+        return (self.ancestors[number] >> ancestor_number) & 1 == 1
+
+
+    def ancestors_bitset(self, id):
+        number = self.numbers.get(id)
+        return self.ancestors[number] if number is not None else 0
+
+
+    def get_ancestors(self, id):
+        """
+        Return the ids of id and of all its ancestors, in topological order
+        """
+        return self.to_ids(self.ancestors_bitset(id))
+
+
+    def descendants_bitset(self, ids):
+        """
+        Return the bitset of the terms that are one of ids or one of their descendants (the bitset of a single id is memoized)
+        """
+        if isinstance(ids, str):
+            if ids not in self.descendants_cache:
+                self.descendants_cache[ids] = self._descendants_bitset([ids])
+            return self.descendants_cache[ids]
+        return self._descendants_bitset(ids)
+
+    def _descendants_bitset(self, ids):
+        stack = [self.numbers[id] for id in ids if id in self.numbers]
+        seen = set(stack)
+        while stack:
+            for child in self.children[stack.pop()]:
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return numbers_bitset(seen, len(self.ids))
+
+
+    def get_descendants(self, ids):
+        """
+        Return the ids of the terms that are one of ids (or id) or one of their descendants, in topological order
+        """
+        return self.to_ids(self.descendants_bitset(ids))
+
+
+    def slim_map(self, ids, slim_ids):
+        """
+        Return the map { id: ids of the terms of slim_ids that are id or one of its ancestors } of the ids in the index
+        """
+        slim_bits = self.bitset(slim_ids)
+        map = { }
+        for id in ids:
+            number = self.numbers.get(id)
+            if number is not None:
+                map[id] = self.to_ids(self.ancestors[number] & slim_bits)
+        return map
+
+
+def parse_ontology(content):
+    """
+    Parse an ontology given as bytes or as a binary file object (plain, gzip or bz2), in the OBO format or in the OBO Graphs JSON format (eg go.json), detected on its first character
+    """
+    if isinstance(content, bytes):
+        content = io.BytesIO(content)
+    content = decompressed(content)
+    return OBO_Parser(content, is_obographs(content))
+
+
+def read_data_version(infile):
+    """
+    Return the data-version of an ontology given as a binary file object (see decompressed)
+    None for an OBO Graphs document, whose version may only come after its nodes
+    """
+    if is_obographs(infile):
+        return None
+    return read_header(infile).get("data-version")
+
+
+def load_obo(source, snapshot_path = None):
+    """
+    Parse an ontology (OBO or OBO Graphs JSON, plain, gzip or bz2) given as a file path or as bytes, reusing the binary snapshot of a previous parse of the same document (same data-version and sha256)
+    The snapshot of a file is saved next to it (<path>.snapshot) unless snapshot_path is given; the snapshot of bytes is only saved if snapshot_path is given
+    """
+    if isinstance(source, bytes):
+        content_hash = hashlib.sha256(source).hexdigest()
+        data_version = read_data_version(decompressed(io.BytesIO(source)))
+    else:
+        content_hash = file_hash(source)
+        with open(source, "rb") as infile:
+            data_version = read_data_version(decompressed(infile))
+        if snapshot_path is None:
+            snapshot_path = source + ".snapshot"
+
+    if snapshot_path:
+        obo = OBO_Parser.load_snapshot(snapshot_path, content_hash, data_version)
+        if obo is not None:
+            print("oboparser: ", len(obo.obo_graph) , " terms loaded from snapshot " + snapshot_path)
+            return obo
+
+    if isinstance(source, bytes):
+        obo = parse_ontology(source)
+    else:
+        with open(source, "rb") as infile:
+            obo = parse_ontology(infile)
+    obo.content_hash = content_hash
+
+    if snapshot_path:
+        try:
+            obo.save_snapshot(snapshot_path)
+        except OSError as e:
+            print("oboparser: could not save snapshot " + snapshot_path + ": " + str(e))
+    return obo
+
+
+def compare_formats(obo_path, obographs_path):
+    """
+    Check that an OBO file and its OBO Graphs JSON version (eg go.obo and go.json of a release) give the same terms, with the same fingerprints
+    Return the ids of the terms missing from one of them or whose fingerprints differ
+    """
+    obo = load_obo(obo_path, False)
+    obographs = load_obo(obographs_path, False)
+    differences = set(obo.get_created_terms(obographs)) | set(obographs.get_created_terms(obo))
+    for ids in obo.get_changed_terms(obographs).values():
+        differences.update(ids)
+    for id in sorted(differences)[:10]:
+        current, previous = obo.get_term(id), obographs.get_term(id)
+        print(id, current.explain_differences(previous) if current and previous else "missing from " + (obographs_path if current else obo_path))
+    print(str(len(differences)) + " terms differ between " + obo_path + " and " + obographs_path)
+    return sorted(differences)
 
 
 def main(argv):
+    if len(argv) == 2:
+        # python obo_parser.py <go.obo> <go.json>
+        sys.exit(1 if compare_formats(argv[0], argv[1]) else 0)
+
     go_obo_url = "https://geneontology-public.s3.amazonaws.com/archive/2019-06-09_go.obo"
     req = requests.get(go_obo_url)
     print("obo downloaded")